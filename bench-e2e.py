@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import shlex
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchlib import SCRIPT, start_mock, stop_mock, mock_call, add_baseline_args, load_baseline, baseline_column, render_table, save_baseline
+
+# sidework-utils arguments per step, {n} is the fleet size and {work} a scratch directory that is emptied before every run
+STEPS = {
+    "list"   : ["--list-all-machines"],
+    "status" : ["--machine-status", "--id-range", "1-{n}", "--format", "csv"],
+    "logs"   : ["--sync-logs", "--id-range", "1-{n}", "--archive-dir", "{work}/archive"],
+    "temps"  : ["--fleet-temps", "--id-range", "1-{n}", "--fleet-dir", "{work}/fleet"],
+    "plan"   : ["--plan", "{work}/plan.yaml", "--yes"],
+}
+
+# newest main and pump firmware of the mock fleet for every machine
+PLAN = """machines:
+  id_range: 1-{n}
+apps:
+  main: "3.3.0"
+  pump: "3.3.0"
+"""
+
+def setup_argparse():
+    parser = argparse.ArgumentParser(prog='bench-e2e',
+                                     description='Time sidework-utils commands end to end against mock-backbar.py fleets of different sizes',
+                                     formatter_class=lambda prog: argparse.HelpFormatter(prog,max_help_position=35))
+    parser.add_argument('--sizes', metavar='N', type=int, nargs='+', default=[10, 100, 1000], help='fleet sizes to benchmark (default 10 100 1000)')
+    parser.add_argument('--steps', metavar='STEP', type=str, nargs='+', choices=list(STEPS), default=list(STEPS), help='steps to run (default all: ' + " ".join(STEPS) + ')')
+    parser.add_argument('--runs', metavar='N', type=int, default=1, help='runs per step and size, median is reported (default 1)')
+    parser.add_argument('--latency', metavar='MS', type=float, default=20, help='mock api latency per request (default 20)')
+    parser.add_argument('--jitter', metavar='MS', type=float, default=10, help=' ^^ plus up to MS random extra latency (default 10)')
+    parser.add_argument('--error-rate', metavar='PCT', type=float, default=0, help='percent of api requests the mock fails with a 500 (default 0)')
+    parser.add_argument('--throttle-rate', metavar='PCT', type=float, default=0, help='percent of api requests the mock throttles with a 429 (default 0)')
+    parser.add_argument('--max-in-flight', metavar='N', type=int, default=0, help='mock answers 429 above N concurrent requests, 0 for no cap (default 0)')
+    parser.add_argument('--temp-hours', metavar='H', type=float, default=24, help='hours in every synthetic TEMPERATURE csv (default 24)')
+    parser.add_argument('--client-args', metavar='ARGS', type=str, default="", help='extra sidework-utils arguments for every step, e.g. "--max-workers 16"')
+    parser.add_argument('--timeout', metavar='SECONDS', type=float, default=900, help='give up on a step after this long (default 900)')
+    add_baseline_args(parser, min_delta=0.25, noise="network noise")
+    return parser.parse_args()
+
+def mock_args(size, args):
+    return ["--machines", size, "--latency", args.latency, "--jitter", args.jitter, "--error-rate", args.error_rate,
+            "--throttle-rate", args.throttle_rate, "--max-in-flight", args.max_in_flight, "--temp-hours", args.temp_hours]
+
+# one cold run of a step against a freshly reset fleet, returns wall seconds, exit code and requests the mock saw
+def run_step(step, size, base_url, key_file, token_file, work, args):
+    shutil.rmtree(work, ignore_errors=True)
+    os.makedirs(work)
+    with open(os.path.join(work, "plan.yaml"), "w") as f:
+        f.write(PLAN.format(n=size))
+    mock_call(base_url, "/__reset", "POST")
+    command = [sys.executable, SCRIPT, "-k", key_file, "-t", token_file, "--base-url", base_url, "--no-cache"]
+    command += [arg.format(n=size, work=work) for arg in STEPS[step]] + shlex.split(args.client_args)
+    start = time.perf_counter()
+    try:
+        result = subprocess.run(command, cwd=work, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, timeout=args.timeout)
+        returncode = result.returncode
+        if returncode != 0:
+            print("!!! " + step + " at " + str(size) + " machines exited " + str(returncode) + ":\n" + result.stderr[-2000:])
+    except subprocess.TimeoutExpired:
+        returncode = "timeout"
+        print("!!! " + step + " at " + str(size) + " machines timed out after " + str(args.timeout) + "s")
+    wall = time.perf_counter() - start
+    counts = mock_call(base_url, "/__stats")['counts']
+    requests = sum(counts.values())
+    throttled = sum(count for name, count in counts.items() if name.endswith(" 429"))
+    return wall, returncode, requests, throttled
+
+def main():
+    args = setup_argparse()
+    scratch = tempfile.mkdtemp(prefix="sidework-bench-")
+    key_file = os.path.join(scratch, "api-key")
+    token_file = os.path.join(scratch, "token")
+    for path in (key_file, token_file):
+        with open(path, "w") as f:
+            f.write("bench\n")
+
+    results = {}
+    try:
+        for size in args.sizes:
+            print("\nBenchmarking " + ", ".join(args.steps) + " against " + str(size) + " mock machines (" + str(args.runs) + " run(s) each)...")
+            mock, base_url = start_mock(mock_args(size, args))
+            try:
+                for step in args.steps:
+                    runs = [run_step(step, size, base_url, key_file, token_file, os.path.join(scratch, "work"), args) for i in range(args.runs)]
+                    results[step + " @" + str(size)] = {
+                        "wall"      : statistics.median(run[0] for run in runs),
+                        "ok"        : all(run[1] == 0 for run in runs),
+                        "requests"  : runs[-1][2],
+                        "throttled" : runs[-1][3]
+                    }
+                    print("* " + step + ": " + str(round(results[step + " @" + str(size)]["wall"], 2)) + "s")
+            finally:
+                stop_mock(mock)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    baseline = load_baseline(args)
+    table = [["Step", "Machines", "Wall (s)", "Requests", "429s", "Baseline (s)", "Exit"]]
+    regressions = []
+    for name, result in results.items():
+        step, size = name.split(" @")
+        base_str = baseline_column(args, baseline, name, result["wall"], 2, regressions)
+        table.append([step, size, str(round(result["wall"], 2)), str(result["requests"]), str(result["throttled"]), base_str,
+                      "ok" if result["ok"] else "FAILED"])
+
+    print("\n" + render_table(table))
+
+    save_baseline(args, {name: {"wall": result["wall"], "requests": result["requests"]} for name, result in results.items()})
+    failed = [name for name, result in results.items() if not result["ok"]]
+    if failed:
+        print("!!! !!! steps failed: " + ", ".join(failed) + " !!! !!!\n")
+    if regressions:
+        print("!!! !!! end to end time regressed more than " + str(args.tolerance) + "% for: " + ", ".join(regressions) + " !!! !!!\n")
+    if failed or regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchlib import SCRIPT, start_mock, stop_mock, mock_call, add_baseline_args, load_baseline, baseline_column, render_table, save_baseline
+
+# every non-interactive subcommand, run for real against a zero latency mock-backbar.py so lazily imported
+# modules (yaml, pandas, numpy, matplotlib) are timed by the commands that load them. {work} is emptied before
+# every run, {temp_log} is a TEMPERATURE csv downloaded from the mock once
+# (--list-logs and --update-fw only drive menus and can't run unattended)
+SUBCOMMANDS = {
+    "--list-all-machines" : ["--list-all-machines"],
+    "--list-latest-apps"  : ["--list-latest-apps", "--target", "main"],
+    "--machine-status"    : ["--machine-status", "1"],
+    "--sync-logs"         : ["--sync-logs", "1", "--archive-dir", "{work}/archive"],
+    "--plan"              : ["--plan", "{work}/plan.yaml", "--yes"],
+    "--graph-temps"       : ["--graph-temps", "1", "--plot-dir", "{work}/plots"],
+    "--render-temps"      : ["--render-temps", "{temp_log}", "--plot-dir", "{work}/plots"],
+    "--analyze-temps"     : ["--analyze-temps", "{temp_log}"],
+    "--fleet-temps"       : ["--fleet-temps", "1", "--fleet-dir", "{work}/fleet"],
+}
+
+PLAN = """machines:
+  ids: [1]
+apps:
+  main: "3.3.0"
+"""
+
+def setup_argparse():
+    parser = argparse.ArgumentParser(prog='bench-startup',
+                                     description='Measure cold run time of each sidework-utils subcommand against mock-backbar.py with python -X importtime',
+                                     formatter_class=lambda prog: argparse.HelpFormatter(prog,max_help_position=35))
+    parser.add_argument('--runs', metavar='N', type=int, default=5, help='cold runs per subcommand, median is reported (default 5)')
+    add_baseline_args(parser, min_delta=0.05, noise="startup noise")
+    parser.add_argument('--top', metavar='N', type=int, default=5, help='show the N slowest top level imports per subcommand (default 5)')
+    return parser.parse_args()
+
+def fetch_temp_log(base_url, path):
+    logs = mock_call(base_url, "/log?machineId=1&count=10")['data']
+    log = next(log for log in logs if "TEMPERATURE" in log['fileName'])
+    with urllib.request.urlopen(log['fileUrl']) as response, open(path, "wb") as f:
+        shutil.copyfileobj(response, f)
+
+# -X importtime writes "import time: self [us] | cumulative | imported package" to stderr
+def parse_importtime(stderr):
+    total_us = 0
+    top_level = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        total_us += int(self_us)
+        if not name[1:].startswith(" "):
+            top_level.append((int(cumulative_us), name.strip()))
+    return total_us, sorted(top_level, reverse=True)
+
+def measure(subcommand, base_url, scratch):
+    work = os.path.join(scratch, "work")
+    shutil.rmtree(work, ignore_errors=True)
+    os.makedirs(work)
+    with open(os.path.join(work, "plan.yaml"), "w") as f:
+        f.write(PLAN)
+    mock_call(base_url, "/__reset", "POST")
+    key_file = os.path.join(scratch, "api-key")
+    command = [sys.executable, "-X", "importtime", SCRIPT, "-k", key_file, "-t", key_file, "--base-url", base_url, "--no-cache"]
+    command += [arg.format(work=work, temp_log=os.path.join(scratch, "TEMPERATURE.csv")) for arg in SUBCOMMANDS[subcommand]]
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=work, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+                            env=dict(os.environ, MPLBACKEND="Agg"))
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        print("!!! " + subcommand + " exited " + str(result.returncode) + ":\n" +
+              "\n".join(line for line in result.stderr.splitlines() if not line.startswith("import time:"))[-2000:])
+        sys.exit(1)
+    total_us, top_level = parse_importtime(result.stderr)
+    return wall, total_us / 1e6, top_level
+
+def main():
+    args = setup_argparse()
+    scratch = tempfile.mkdtemp(prefix="sidework-startup-")
+    with open(os.path.join(scratch, "api-key"), "w") as f:
+        f.write("bench\n")
+    results = {}
+    mock, base_url = start_mock(["--machines", 3, "--logs-per-machine", 2, "--temp-hours", 6])
+    try:
+        fetch_temp_log(base_url, os.path.join(scratch, "TEMPERATURE.csv"))
+        print("\nMeasuring cold runs of " + str(len(SUBCOMMANDS)) + " subcommands against mock-backbar.py (" + str(args.runs) + " runs each)...\n")
+        for subcommand in SUBCOMMANDS:
+            runs = [measure(subcommand, base_url, scratch) for i in range(args.runs)]
+            results[subcommand] = {
+                "wall"    : statistics.median(run[0] for run in runs),
+                "imports" : statistics.median(run[1] for run in runs),
+                "top"     : runs[-1][2][:args.top]
+            }
+    finally:
+        stop_mock(mock)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    baseline = load_baseline(args)
+    table = [["Subcommand", "Wall (s)", "Imports (s)", "Baseline (s)", "Slowest imports"]]
+    regressions = []
+    for subcommand, result in results.items():
+        base_str = baseline_column(args, baseline, subcommand, result["wall"], 3, regressions)
+        slowest = ", ".join(name + " " + str(round(us / 1000)) + "ms" for us, name in result["top"])
+        table.append([subcommand, str(round(result["wall"], 3)), str(round(result["imports"], 3)), base_str, slowest])
+
+    print(render_table(table))
+
+    save_baseline(args, {subcommand: {"wall": result["wall"], "imports": result["imports"]} for subcommand, result in results.items()})
+    if regressions:
+        print("!!! !!! startup regressed more than " + str(args.tolerance) + "% for: " + ", ".join(regressions) + " !!! !!!\n")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# shared by bench-e2e.py and bench-startup.py: starting mock-backbar.py and the --save / --compare baseline handling
+
+import json
+import os
+import subprocess
+import sys
+import urllib.request
+
+ROOT   = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(ROOT, "sidework-utils.py")
+MOCK   = os.path.join(ROOT, "mock-backbar.py")
+
+# mock on a free port, returns the process and its base url
+def start_mock(mock_args):
+    command = [sys.executable, MOCK, "--port", "0"] + [str(arg) for arg in mock_args]
+    mock = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    first_line = mock.stdout.readline()
+    if not first_line.startswith("listening on "):
+        mock.kill()
+        print("Error: mock-backbar.py did not start")
+        sys.exit(1)
+    return mock, first_line.split("listening on ", 1)[1].strip()
+
+def stop_mock(mock):
+    mock.terminate()
+    mock.wait()
+
+def mock_call(base_url, path, method="GET"):
+    with urllib.request.urlopen(urllib.request.Request(base_url + path, method=method, data=b"" if method == "POST" else None)) as response:
+        return json.loads(response.read())
+
+def add_baseline_args(parser, min_delta, noise):
+    parser.add_argument('--save', metavar='FILE', type=str, help='save results as a baseline json file')
+    parser.add_argument('--compare', metavar='FILE', type=str, help='compare against a saved baseline and fail on regressions')
+    parser.add_argument('--tolerance', metavar='PCT', type=float, default=20, help=' ^^ allowed slowdown in percent before failing (default 20)')
+    parser.add_argument('--min-delta', metavar='SECONDS', type=float, default=min_delta, help=' ^^ ignore slowdowns smaller than this, ' + noise + ' (default ' + str(min_delta) + ')')
+
+def load_baseline(args):
+    if not args.compare:
+        return None
+    with open(args.compare) as f:
+        return json.load(f)
+
+# baseline column of a result, names slower than --tolerance percent and --min-delta seconds go to regressions
+def baseline_column(args, baseline, name, wall, digits, regressions):
+    base = baseline.get(name) if baseline else None
+    if base is None:
+        return "-"
+    base_str = str(round(base["wall"], digits))
+    slowdown = wall - base["wall"]
+    if slowdown > base["wall"] * args.tolerance / 100 and slowdown > args.min_delta:
+        regressions.append(name)
+        base_str += " !!"
+    return base_str
+
+def render_table(table):
+    col_widths = [max(len(row[i]) for row in table) for i in range(len(table[0]))]
+    lines = ["".join(item.ljust(col_widths[i] + 4) for i, item in enumerate(row)) for row in table]
+    lines.insert(1, "-" * len(lines[0]))
+    return "\n".join(lines) + "\n"
+
+def save_baseline(args, baseline):
+    if not args.save:
+        return
+    with open(args.save, "w") as f:
+        json.dump(baseline, f, indent=2)
+    print("*** Baseline saved to " + args.save + " ***\n")
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+ORGANIZATIONS = ["Gregorys Coffee", "BackBar", "Sidework"]
+LOCATIONS     = ["Park Ave", "Soho", "Midtown", "Flatiron", "Chelsea", "Tribeca", "Astoria", "Dumbo"]
+
+# board type name, api type ID, boards per machine (pumps are told apart by protocolId)
+BOARD_LAYOUT = [
+    ("Main",          1,  1),
+    ("Solenoid",      2,  1),
+    ("Pump",          5,  2),
+    ("Nozzle",        6,  1),
+    ("Ice Dispenser", 7,  1),
+    ("Cooling",       9,  1),
+    ("Conveyor",      10, 1),
+    ("QR Reader",     11, 1),
+]
+APP_NOTES            = ["", "", "", "beta", "release-62-pump-hotfix", "nightly"]
+TEMP_SAMPLE_SECONDS  = 10
+TEMP_CYCLE_MINUTES   = 40
+TEMP_VARIANTS        = 16
+TEMP_MISSING_NEWLINE = 0.02
+TEMP_YEARS           = 4
+FLEET_START          = datetime(2026, 1, 5)
+
+def setup_argparse():
+    parser = argparse.ArgumentParser(prog='mock-backbar',
+                                     description='Local stand-in for the Backbar api with a synthetic fleet, for testing and benchmarking sidework-utils offline',
+                                     formatter_class=lambda prog: argparse.HelpFormatter(prog,max_help_position=35))
+    parser.add_argument('--host', metavar='HOST', type=str, default='127.0.0.1', help='address to listen on (default 127.0.0.1)')
+    parser.add_argument('--port', metavar='PORT', type=int, default=8080, help='port to listen on, 0 picks a free one (default 8080)')
+    parser.add_argument('--machines', metavar='N', type=int, default=100, help='machines in the synthetic fleet (default 100)')
+    parser.add_argument('--app-versions', metavar='N', type=int, default=30, help='firmware versions per board target (default 30)')
+    parser.add_argument('--logs-per-machine', metavar='N', type=int, default=6, help='log files per machine, half of them TEMPERATURE csvs (default 6)')
+    parser.add_argument('--temp-hours', metavar='H', type=float, default=24, help='hours of 10s samples in every TEMPERATURE csv (default 24)')
+    parser.add_argument('--seed', metavar='N', type=int, default=1, help='random seed, the same seed always gives the same fleet (default 1)')
+    parser.add_argument('--latency', metavar='MS', type=float, default=0, help='added delay per request in milliseconds (default 0)')
+    parser.add_argument('--jitter', metavar='MS', type=float, default=0, help=' ^^ plus a random extra delay of up to MS (default 0)')
+    parser.add_argument('--error-rate', metavar='PCT', type=float, default=0, help='percent of api requests answered with a 500 (default 0)')
+    parser.add_argument('--throttle-rate', metavar='PCT', type=float, default=0, help='percent of api requests answered with a 429 (default 0)')
+    parser.add_argument('--max-in-flight', metavar='N', type=int, default=0, help='answer 429 while more than N requests are in flight, 0 for no cap (default 0)')
+    parser.add_argument('--retry-after', metavar='SECONDS', type=float, default=1, help=' ^^ Retry-After sent with every 429 (default 1)')
+    parser.add_argument('--install-after', metavar='SECONDS', type=float, help='queued firmware gets installed this long after the PUT (default: boards stay Pending)')
+    parser.add_argument('--install-failure-rate', metavar='PCT', type=float, default=0, help=' ^^ percent of installs that fail and stay on the old firmware (default 0)')
+    parser.add_argument('--verbose', action='store_true', help='print every request')
+    return parser.parse_args()
+
+# every machine, board, app and log is generated up front from the seed, temperature csvs on request
+class Fleet:
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        rng = random.Random(self.args.seed)
+        self.apps = []
+        for type_name, type_id, count in BOARD_LAYOUT:
+            for i in range(self.args.app_versions):
+                self.apps.append({
+                    'id'       : len(self.apps) + 1,
+                    'type'     : {'id': type_id, 'name': type_name},
+                    'fwMajor'  : 1 + i // 10,
+                    'fwMinor'  : i % 10 // 3,
+                    'fwPatch'  : i % 10 % 3,
+                    'notes'    : APP_NOTES[rng.randrange(len(APP_NOTES))],
+                    'filePath' : "s3://sidework-firmware/" + type_name.lower().replace(" ", "-") + "/" + str(len(self.apps) + 1) + ".bin"
+                })
+        apps_by_type = {}
+        for app in self.apps:
+            apps_by_type.setdefault(app['type']['name'], []).append(app)
+
+        self.machines = []
+        self.boards = {}
+        self.boards_by_id = {}
+        self.logs = {}
+        self.install_at = {}
+        for machine_id in range(1, self.args.machines + 1):
+            org = ORGANIZATIONS[rng.randrange(len(ORGANIZATIONS))]
+            machine = {
+                'id'           : machine_id,
+                'name'         : "GC" + str(machine_id) + " " + LOCATIONS[rng.randrange(len(LOCATIONS))],
+                'serialNumber' : 240000 + machine_id * 7,
+                'location'     : {'organization': {'name': org}}
+            }
+            self.machines.append(machine)
+            boards = []
+            for type_name, type_id, count in BOARD_LAYOUT:
+                for protocol_id in range(1, count + 1):
+                    candidates = apps_by_type[type_name]
+                    # most of the fleet runs one of the newest few versions
+                    application = candidates[-1 - min(int(rng.expovariate(0.7)), len(candidates) - 1)]
+                    previous = candidates[max(candidates.index(application) - 1, 0)]
+                    board = {
+                        'id'          : machine_id * 100 + len(boards),
+                        'type'        : {'id': type_id, 'name': type_name},
+                        'machine'     : {'id': machine_id, 'name': machine['name']},
+                        'protocolId'  : protocol_id,
+                        'pcbMajor'    : 2,
+                        'pcbMinor'    : rng.randrange(3),
+                        'pcbPatch'    : 0,
+                        'status'      : "Installed",
+                        'application' : application,
+                        'previous'    : previous,
+                        'scheduled'   : None
+                    }
+                    boards.append(board)
+                    self.boards_by_id[board['id']] = board
+            self.boards[machine_id] = boards
+            logs = []
+            for index in range(self.args.logs_per_machine):
+                day = FLEET_START + timedelta(days=index // 2)
+                kind = "TEMPERATURE" if index % 2 == 0 else "EVENT"
+                logs.append({
+                    'id'        : machine_id * 1000 + index,
+                    'machineId' : machine_id,
+                    'fileName'  : "logs/" + str(machine['serialNumber']) + "/" + day.strftime("%Y-%m-%d") + "_" + kind + ".csv",
+                    'addDT'     : (day + timedelta(hours=23, minutes=59)).strftime("%Y-%m-%dT%H:%M:%S"),
+                    'index'     : index
+                })
+            self.logs[machine_id] = logs[::-1]
+
+    def machine_list(self, params):
+        machines = self.machines
+        if 'organization' in params:
+            machines = [machine for machine in machines if machine['location']['organization']['name'].lower() == params['organization'].lower()]
+        if 'name' in params:
+            machines = [machine for machine in machines if params['name'] in machine['name']]
+        return machines
+
+    # queued firmware whose install time passed is installed (or fails) when the boards are read
+    def board_list(self, machine_id):
+        now = time.time()
+        with self.lock:
+            for board in self.boards.get(machine_id, []):
+                install_at = self.install_at.get(board['id'])
+                if install_at is None or install_at > now:
+                    continue
+                del self.install_at[board['id']]
+                if random.uniform(0, 100) >= self.args.install_failure_rate:
+                    board['previous'] = board['application']
+                    board['application'] = board['scheduled']
+                board['scheduled'] = None
+                board['status'] = "Installed"
+            return json.loads(json.dumps(self.boards.get(machine_id, [])))
+
+    def put_board(self, board_id, body):
+        with self.lock:
+            board = self.boards_by_id.get(board_id)
+            if board is None:
+                return None
+            board['scheduled'] = body.get('scheduled')
+            board['status'] = body.get('status', board['status'])
+            self.install_at.pop(board_id, None)
+            if board['scheduled'] is not None and self.args.install_after is not None:
+                self.install_at[board_id] = time.time() + self.args.install_after
+            return board
+
+    def log_page(self, machine_id, count, page):
+        logs = self.logs.get(machine_id, [])
+        return logs[(page - 1) * count:page * count]
+
+    def log_file(self, machine_id, index):
+        logs = [log for log in self.logs.get(machine_id, []) if log['index'] == index]
+        if not logs:
+            return None
+        if "TEMPERATURE" in logs[0]['fileName']:
+            variant = (machine_id * 31 + index) % TEMP_VARIANTS
+            return temperature_csv(variant, index // 2, self.args.temp_hours, self.args.seed)
+        return event_log(machine_id, index, self.args.seed)
+
+# compressor cycling between ~34F and ~39F with sensor noise, some variants drift warm or lose a few rows.
+# odd variants are dated up to TEMP_YEARS - 1 years back and drop the newline before ~2% of their rows like
+# the real boards do, so the row delimiter repair in sidework-utils gets exercised
+# a day's csv is built once per variant and shared by many machines so serving files never slows the mock down
+@lru_cache(maxsize=256)
+def temperature_csv(variant, day, hours, seed):
+    rng = random.Random(seed * 1000003 + variant * 101 + day)
+    mangled = variant % 2 == 1
+    start = FLEET_START + timedelta(days=day)
+    if mangled:
+        start = start.replace(year=start.year - (variant // 2) % TEMP_YEARS)
+    warm = 4.0 if rng.random() < 0.1 else 0.0
+    period = TEMP_CYCLE_MINUTES * 60 * rng.uniform(0.8, 1.2)
+    rows = ["Timestamp,In 1 Temp,In 2 Temp,Out Temp"]
+    for sample in range(int(hours * 3600 / TEMP_SAMPLE_SECONDS)):
+        seconds = sample * TEMP_SAMPLE_SECONDS
+        if rng.random() < 0.001:
+            continue
+        cycle = 36.5 + warm + 2.5 * math.sin(2 * math.pi * seconds / period)
+        timestamp = (start + timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S")
+        row = (timestamp + "," + format(cycle + rng.gauss(0, 0.2), ".2f") + "," + format(cycle - 1 + rng.gauss(0, 0.2), ".2f") +
+               "," + format(72 + rng.gauss(0, 0.5), ".1f"))
+        if mangled and rng.random() < TEMP_MISSING_NEWLINE:
+            rows[-1] += row
+        else:
+            rows.append(row)
+    return ("\n".join(rows) + "\n").encode()
+
+def event_log(machine_id, index, seed):
+    rng = random.Random(seed * 1000003 + machine_id * 101 + index)
+    start = FLEET_START + timedelta(days=index // 2)
+    lines = ["Timestamp,Event"]
+    for i in range(200):
+        timestamp = (start + timedelta(seconds=i * 400)).strftime("%Y-%m-%d %H:%M:%S")
+        lines.append(timestamp + "," + rng.choice(["DRINK_POURED", "CLEAN_CYCLE", "DOOR_OPEN", "DOOR_CLOSED", "ICE_LOW"]))
+    return ("\n".join(lines) + "\n").encode()
+
+# requests per endpoint and status, served on /__stats so benchmarks can count what a command sent
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.counts = {}
+
+    def count(self, endpoint, status):
+        with self.lock:
+            key = endpoint + " " + str(status)
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+def endpoint_name(method, path):
+    return method + " " + re.sub(r"/\d+", "/{id}", path)
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.args.verbose:
+            sys.stderr.write(self.address_string() + " " + (format % args) + "\n")
+
+    def send_body(self, status, body, content_type="application/json", headers=None):
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            status, body = 304, b""
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if status in (200, 304):
+            self.send_header('ETag', etag)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+        return status
+
+    def send_json(self, status, data):
+        return self.send_body(status, json.dumps(data).encode())
+
+    # latency, 500s and 429s are injected into api calls only, files are served like s3 would
+    def inject_faults(self):
+        args = self.server.args
+        if args.latency or args.jitter:
+            time.sleep((args.latency + random.uniform(0, args.jitter)) / 1000)
+        if args.max_in_flight and self.server.stats.in_flight > args.max_in_flight:
+            return self.throttle()
+        roll = random.uniform(0, 100)
+        if roll < args.throttle_rate:
+            return self.throttle()
+        if roll < args.throttle_rate + args.error_rate:
+            return self.send_json(500, {'error': 'injected failure'})
+        return None
+
+    def throttle(self):
+        return self.send_body(429, json.dumps({'error': 'too many requests'}).encode(), headers={'Retry-After': format(self.server.args.retry_after, "g")})
+
+    def handle_request(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        stats = self.server.stats
+        fleet = self.server.fleet
+        endpoint = endpoint_name(self.command, url.path)
+        status = 500
+        with stats.lock:
+            stats.in_flight += 1
+        try:
+            if url.path == "/__stats":
+                with stats.lock:
+                    counts = dict(stats.counts)
+                self.send_json(200, {'counts': counts})
+                return
+            if url.path == "/__reset" and self.command == "POST":
+                with fleet.lock:
+                    fleet.reset()
+                with stats.lock:
+                    stats.counts = {}
+                self.send_json(200, {'ok': True})
+                return
+            file_match = re.fullmatch(r"/files/(\d+)/(\d+)", url.path)
+            if file_match and self.command in ("GET", "HEAD"):
+                content = fleet.log_file(int(file_match.group(1)), int(file_match.group(2)))
+                status = self.send_body(200, content, "text/csv") if content is not None else self.send_json(404, {'error': 'no such file'})
+                return
+            status = self.inject_faults()
+            if status is not None:
+                return
+            status = self.route(url.path, params)
+        except (ValueError, KeyError) as e:
+            status = self.send_json(400, {'error': str(e)})
+        finally:
+            with stats.lock:
+                stats.in_flight -= 1
+            if url.path not in ("/__stats", "/__reset"):
+                stats.count(endpoint, status)
+
+    def route(self, path, params):
+        fleet = self.server.fleet
+        if self.command == "GET" and path == "/machine":
+            return self.send_json(200, fleet.machine_list(params))
+        if self.command == "GET" and path == "/application":
+            return self.send_json(200, fleet.apps)
+        if self.command == "GET" and path == "/board":
+            return self.send_json(200, fleet.board_list(int(params['machineId'])))
+        board_match = re.fullmatch(r"/board/(\d+)", path)
+        if self.command == "PUT" and board_match:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+            board = fleet.put_board(int(board_match.group(1)), body)
+            return self.send_json(200, board) if board is not None else self.send_json(404, {'error': 'no such board'})
+        if self.command == "GET" and path == "/log":
+            host = "http://" + self.headers.get('Host', self.server.server_address[0] + ":" + str(self.server.server_address[1]))
+            logs = fleet.log_page(int(params['machineId']), int(params.get('count', 10)), int(params.get('page', 1)))
+            data = [dict({key: value for key, value in log.items() if key != 'index'},
+                         fileUrl=host + "/files/" + str(log['machineId']) + "/" + str(log['index'])) for log in logs]
+            return self.send_json(200, {'data': data})
+        return self.send_json(404, {'error': 'unknown endpoint ' + self.command + " " + path})
+
+    do_GET = handle_request
+    do_HEAD = handle_request
+    do_PUT = handle_request
+    do_POST = handle_request
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # clients hanging up mid download (Ctrl-C, cancelled runs) are normal here
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+def main():
+    args = setup_argparse()
+    server = MockServer((args.host, args.port), Handler)
+    server.args = args
+    server.fleet = Fleet(args)
+    server.stats = Stats()
+    boards = sum(len(boards) for boards in server.fleet.boards.values())
+    # build every temperature csv up front, the first download of each would otherwise hold up all other requests
+    for variant in range(min(TEMP_VARIANTS, args.machines * args.logs_per_machine)):
+        for day in range((args.logs_per_machine + 1) // 2):
+            temperature_csv(variant, day, args.temp_hours, args.seed)
+    # first line is read by bench-e2e.py to find the port
+    print("listening on http://" + args.host + ":" + str(server.server_address[1]), flush=True)
+    print(str(len(server.fleet.machines)) + " machines, " + str(boards) + " boards, " + str(len(server.fleet.apps)) + " apps, " +
+          str(sum(len(logs) for logs in server.fleet.logs.values())) + " logs", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -5,37 +5,174 @@ import os
 import requests
 import json
 from simple_term_menu import TerminalMenu
-from enum import Enum
-import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-import numpy as np
-from scipy.fft import fft, fftfreq
-import tkinter as tk
-from tkinter import filedialog
+from collections import namedtuple
 import sys
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
 import re
+import csv
+import gzip
+import sqlite3
+import random
+import hashlib
+import tempfile
+import bisect
+import threading
+import contextlib
+try:
+    import orjson
+except ImportError:
+    orjson = None
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode, urlparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
-class target(Enum):
-    main          = 1
-    solenoid      = 2
-    pump          = 5
-    nozzle        = 6
-    ice_dispenser = 7
-    cooling       = 9
-    conveyor      = 10
-    qr_reader     = 11
-
-class updateTargetEnum(Enum):
-    Main     = 0
-    Solenoid = 1
-    Pump     = 2
-    Nozzle   = 3
-    Cooling  = 4
-    QR       = 5
+def catalog_key(target):
+    return target.lower().replace(" ", "_")
+
+# every board type the api reports: api name, api type ID, whether firmware can be queued on it
+# and whether a machine has several of them (told apart by protocolId)
+BoardType = namedtuple("BoardType", ["name", "type_id", "updatable", "multi_instance"])
+
+BOARD_TYPES = [
+    BoardType("Main",          1,  True,  False),
+    BoardType("Solenoid",      2,  True,  False),
+    BoardType("Pump",          5,  True,  True),
+    BoardType("Nozzle",        6,  True,  False),
+    BoardType("Ice Dispenser", 7,  False, False),
+    BoardType("Cooling",       9,  True,  False),
+    BoardType("Conveyor",      10, False, False),
+    BoardType("QR Reader",     11, True,  False),
+]
+BOARD_TYPES_BY_ID   = {board_type.type_id: board_type for board_type in BOARD_TYPES}
+BOARD_TYPES_BY_NAME = {board_type.name: board_type for board_type in BOARD_TYPES}
+BOARD_TYPES_BY_KEY  = {catalog_key(board_type.name): board_type for board_type in BOARD_TYPES}
+
+# board types offered by --update-fw / --plan, selected apps are kept in a dict keyed by these names,
+# "None" clears whatever is queued on that target and targets missing from the dict are left alone
+UPDATE_TARGETS = [board_type.name for board_type in BOARD_TYPES if board_type.updatable]
+
+def no_apps():
+    return {target: "None" for target in UPDATE_TARGETS}
+
+# the api type ID is matched first so a renamed type keeps its targets, the name covers types without one
+def find_board_type(type_info):
+    return BOARD_TYPES_BY_ID.get(type_info.get('id')) or BOARD_TYPES_BY_NAME.get(type_info.get('name'))
+
+# registry name of an api type, unknown types keep the name the api gave them
+def board_type_name(type_info):
+    board_type = find_board_type(type_info)
+    return board_type.name if board_type is not None else type_info.get('name')
+
+def board_label(board):
+    board_type = find_board_type(board['type'])
+    if board_type is not None and board_type.multi_instance:
+        return board_type.name + " " + str(board['protocolId'])
+    return str(board_type_name(board['type']))
+
+def format_version(version, notes):
+    return (".".join(str(part) for part in version) + " " + str(notes or "")).strip()
+
+# api records are decoded once into slotted records holding the fields commands read, with the
+# version as a comparable tuple and its display strings precomputed
+class App:
+    __slots__ = ("id", "target", "version", "version_str", "notes", "file_path", "label", "raw")
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.id = raw.get('id')
+        self.target = board_type_name(raw.get('type') or {})
+        self.version = (raw['fwMajor'], raw['fwMinor'], raw['fwPatch'])
+        self.version_str = ".".join(str(part) for part in self.version)
+        self.notes = raw.get('notes')
+        self.file_path = raw.get('filePath')
+        self.label = format_version(self.version, self.notes)
+
+# every board running (or queued with) the same application shares one App. the catalog builds its own
+# Apps straight from /application records (their raw becomes the PUT body), board copies never end up there
+app_records = {}
+
+def decode_app(raw):
+    if raw is None:
+        return None
+    key = (raw.get('id'), raw['fwMajor'], raw['fwMinor'], raw['fwPatch'], raw.get('notes'), raw.get('filePath'))
+    app = app_records.get(key)
+    if app is None:
+        app = app_records.setdefault(key, App(raw))
+    return app
+
+# raw (the api dict) is only kept when the board is about to be PUT back
+class Board:
+    __slots__ = ("id", "type_name", "label", "machine_id", "machine_name", "pcb_version", "status", "application", "scheduled", "previous", "raw")
+
+    def __init__(self, raw, keep_raw=False):
+        self.raw = raw if keep_raw else None
+        self.id = raw['id']
+        self.type_name = board_type_name(raw['type'])
+        self.label = board_label(raw)
+        self.machine_id = raw['machine']['id']
+        self.machine_name = raw['machine']['name']
+        self.pcb_version = format_version((raw['pcbMajor'], raw['pcbMinor'], raw['pcbPatch']), None)
+        self.status = raw['status']
+        self.application = decode_app(raw['application'])
+        self.scheduled = decode_app(raw['scheduled'])
+        self.previous = decode_app(raw['previous'])
+
+class Machine:
+    __slots__ = ("id", "name", "serial", "org")
+
+    def __init__(self, raw):
+        self.id = raw['id']
+        self.name = raw['name']
+        self.serial = str(raw['serialNumber'])
+        self.org = raw['location']['organization']['name']
+
+RETRY_STATUS_CODES    = [429, 500, 502, 503, 504]
+THROTTLE_STATUS_CODES = [429, 503]
+MAX_RETRIES           = 4
+BACKOFF_BASE          = 0.5
+RETRY_AFTER_MAX       = 120
+AIMD_DECREASE         = 0.5
+AIMD_COOLDOWN         = 1.0
+MIN_RATE              = 1.0
+LATENCY_BUCKETS       = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]
+
+API_BASE_URL       = os.environ.get("SIDEWORK_API_URL", "https://api.backbar.com")
+CONNECT_TIMEOUT    = 5
+READ_TIMEOUT       = 30
+
+DOWNLOAD_CHUNK_SIZE        = 256 * 1024
+LOG_ETAGS_FILE             = ".sidework-log-etags.json"
+LOG_PAGE_SIZE              = 100
+LOG_MANIFEST_FILE          = "manifest.sqlite"
+SNAPSHOT_DB                = "fleet-snapshots.sqlite"
+
+TEMP_COLUMNS               = ["In 1 Temp", "In 2 Temp", "Out Temp"]
+TEMP_READ_SIZE             = 1024 * 1024
+TEMP_CABINET_COLUMNS       = ["In 1 Temp", "In 2 Temp"]
+TEMP_THRESHOLD             = 41.0
+TEMP_RESAMPLE              = "1min"
+TEMP_ROLLING_WINDOW        = "1h"
+TEMP_MAX_GAP_SECONDS       = 600
+TEMP_MIN_EXCURSION_SECONDS = 300
+TEMP_MIN_CYCLE_MINUTES     = 5
+TEMP_MAX_CYCLE_MINUTES     = 360
+TEMP_PLOT_DIR              = "temp-plots"
+TEMP_PLOT_WIDTH            = 1400
+TEMP_PLOT_DPI              = 100
+TEMP_PLOT_HOURLY_SPAN      = timedelta(days=2)
+TEMP_HISTOGRAM_BINS        = [round(-40 + 0.1 * i, 1) for i in range(1801)]
+TEMP_WORST_OFFENDERS       = 10
+REPORT_BUFFER_SIZE         = 1024 * 1024
+POLL_MIN_SECONDS           = 5
+POLL_MAX_SECONDS           = 60
+POLL_BACKOFF               = 1.5
+MENU_PAGE_SIZE             = 40
+
+CACHE_DIR          = os.path.join(os.path.expanduser("~"), ".cache", "sidework-utils")
+CACHE_MAX_BYTES    = 64 * 1024 * 1024
+CACHE_TTLS         = {"machine": 600, "application": 300}
 
 def setup_argpase():
     parser = argparse.ArgumentParser(prog='sidework-utils', 
@@ -46,18 +183,60 @@ def setup_argpase():
     parser.add_argument('-t', '--token', metavar='TOKEN', required=True, help="auth token stored in a file")
     parser.add_argument('--list-latest-apps', action='store_true', help='prints most recent deployed firmware applications, sorted by target')
     parser.add_argument('--target', metavar='TARGET', type=str, help=' ^^ list only recent apps for provided target (qr_reader, pump, etc)')
-    parser.add_argument('--machine-status', metavar='ID', type=int, help='view previous, current and queued applications for specified machine ID')
+    parser.add_argument('--machine-status', metavar='ID', type=int, nargs='*', help='view previous, current and queued applications for specified machine ID(s) (or all machines matching a filter)')
+    parser.add_argument('--format', choices=['table', 'csv', 'json'], default='table', help=' ^^ output format for machine status, snapshots and temp analysis (default table)')
+    parser.add_argument('--snapshot', metavar='ID', type=int, nargs='*', help='store the board state of the whole fleet (or machine ID(s) / a filter) and print what changed since the last snapshot')
+    parser.add_argument('--snapshot-db', metavar='FILE', type=str, default=SNAPSHOT_DB, help=' ^^ sqlite file snapshots are kept in (default ' + SNAPSHOT_DB + ')')
+    parser.add_argument('--query-fw', metavar=('TARGET', 'VERSION'), type=str, nargs='+', help='list machines whose TARGET board runs VERSION (1.4 or 1.4.2) in the latest snapshot, or count versions without VERSION')
     parser.add_argument('--list-all-machines', action='store_true', help='prints list of all valid machine names with ID and serial numbers')
     parser.add_argument('--gregorys', action='store_true', help=' ^^ pass this flag to only list all gregorys org machines')
     parser.add_argument('--backbar', action='store_true', help=' ^^ pass this flag to only list backbar org machines')
     parser.add_argument('--name-filter', metavar='FILTER', type=str, help=' ^^ pass this flag to filter listed machines by checking names')
+    parser.add_argument('--org', metavar='ORG', type=str, nargs='+', help=' ^^ only machines in any of these organizations (case insensitive)')
+    parser.add_argument('--name-prefix', metavar='PREFIX', type=str, help=' ^^ only machines whose name starts with PREFIX')
+    parser.add_argument('--name-regex', metavar='REGEX', type=str, help=' ^^ only machines whose name matches REGEX')
+    parser.add_argument('--id-range', metavar='RANGE', type=str, nargs='+', help=' ^^ only machines with IDs in these ranges (80-120 or single IDs)')
+    parser.add_argument('--serial', metavar='SERIAL', type=str, nargs='+', help=' ^^ only machines with these serial numbers')
+    parser.add_argument('--server-filter', action='store_true', help=' ^^ also send org/name filters to the api as query params (filters always run locally too)')
     parser.add_argument('--list-logs', metavar='ID', type=int, help='returns URLs to logs of machine specified by ID number')
-    parser.add_argument('--graph-temps', metavar='ID', type=int, help='graph recent temperature data for machine specified by ID number')
+    parser.add_argument('--sync-logs', metavar='ID', type=int, nargs='*', help='download all new logs for machine ID(s) (or all machines matching a filter) into a local archive')
+    parser.add_argument('--archive-dir', metavar='DIR', type=str, default='log-archive', help=' ^^ directory for the compressed log archive (default log-archive)')
+    parser.add_argument('--graph-temps', metavar='ID', type=int, nargs='*', help='graph recent temperature data for machine specified by ID number (several IDs or a filter render headless to --plot-dir)')
+    parser.add_argument('--render-temps', metavar='FILE', type=str, nargs='+', help='render charts for downloaded temperature logs (.gz ok) headless into --plot-dir')
+    parser.add_argument('--plot-dir', metavar='DIR', type=str, help=' ^^ render charts to files in DIR instead of opening a window (default temp-plots)')
+    parser.add_argument('--plot-format', choices=['png', 'svg'], default='png', help=' ^^ chart file format (default png)')
+    parser.add_argument('--plot-width', metavar='PX', type=int, default=TEMP_PLOT_WIDTH, help=' ^^ chart width in pixels, data is decimated to this (default 1400)')
+    parser.add_argument('--fleet-temps', metavar='ID', type=int, nargs='*', help='summarize temperature logs across machine ID(s) (or all machines matching a filter) into parquet files')
+    parser.add_argument('--fleet-dir', metavar='DIR', type=str, default='fleet-temps', help=' ^^ directory for downloaded logs and summaries (default fleet-temps)')
+    parser.add_argument('--latest-temps', metavar='N', type=int, default=1, help='number of newest temperature logs per machine used by --graph-temps/--fleet-temps (default 1)')
+    parser.add_argument('--analyze-temps', metavar='FILE', type=str, nargs='+', help='compute duty cycle, cycle period, excursions etc from downloaded temperature logs (.gz ok)')
+    parser.add_argument('--temp-threshold', metavar='F', type=float, default=TEMP_THRESHOLD, help=' ^^ cabinet temperature considered too warm (default 41)')
+    parser.add_argument('--analysis-dir', metavar='DIR', type=str, help=' ^^ also write summary json, rolling stats csv and excursions csv per file here')
     parser.add_argument('--update-fw', action='store_true', help='select machine(s) for updating and fw per target')
     parser.add_argument('--notes-filter', metavar='NOTES', type=str, help='filter fw apps by notes (pass PROD to filter by production releases)')
     parser.add_argument('--clear', action='store_true', help='select machine(s) with pending fw updates to cancel')
+    parser.add_argument('--plan', metavar='FILE', type=str, help='run a firmware rollout described in a yaml plan file without menus (with --clear: clear the planned machines)')
+    parser.add_argument('--yes', action='store_true', help=' ^^ skip the confirmation prompt (for scheduled / scripted rollouts)')
+    parser.add_argument('--canary', metavar='N', type=int, help='roll out in waves: N canary machines first, then --wave-percent batches, each gated on installs')
+    parser.add_argument('--wave-percent', metavar='PCT', type=float, default=25, help=' ^^ size of each wave after the canary, in percent of all machines (default 25)')
+    parser.add_argument('--success-threshold', metavar='PCT', type=float, default=100, help=' ^^ percent of a wave that has to install before the next wave starts (default 100)')
+    parser.add_argument('--poll-timeout', metavar='SECONDS', type=int, default=3600, help=' ^^ max seconds to wait for a wave to leave Pending (default 3600)')
+    parser.add_argument('--auto-revert', action='store_true', help=' ^^ clear queued updates on the failing wave when a rollout halts')
+    parser.add_argument('--max-workers', metavar='N', type=int, default=8, help='max number of api requests in flight at once (default 8)')
+    parser.add_argument('--host-rate', metavar='N', type=float, default=0, help='hard cap on requests started per second per host, 0 for no cap (default 0)')
+    parser.add_argument('--read-rate', metavar='N', type=float, default=25, help='api reads (GET) per second to start at, adapts to throttling, 0 for no limit (default 25)')
+    parser.add_argument('--write-rate', metavar='N', type=float, default=10, help='board writes (PUT) per second to start at, adapts to throttling, 0 for no limit (default 10)')
+    parser.add_argument('--base-url', metavar='URL', type=str, default=API_BASE_URL, help='api to talk to, e.g. a local mock-backbar.py (default $SIDEWORK_API_URL or https://api.backbar.com)')
+    parser.add_argument('--timeout', metavar='SECONDS', type=float, default=READ_TIMEOUT, help='max seconds to wait on any single api response (default 30)')
+    parser.add_argument('--no-cache', action='store_true', help='do not read or write the local machine/application cache')
+    parser.add_argument('--profile', action='store_true', help='print where the run spent its time (api latency per endpoint, parsing, plotting, ui waits)')
+    parser.add_argument('--profile-trace', metavar='FILE', type=str, help=' ^^ also write a chrome trace json (open in chrome://tracing or ui.perfetto.dev)')
+    parser.add_argument('--refresh', action='store_true', help='ignore cache TTLs and revalidate machine/application lists with the api')
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.query_fw is not None and len(args.query_fw) > 2:
+        parser.error("argument --query-fw: expected TARGET and an optional VERSION, got " + str(len(args.query_fw)) + " values")
+    return args
 
 def read_file(file):
     with open(file, "r") as f:
@@ -67,10 +246,6 @@ def write_file(file, content):
     with open(file, "w") as f:
         f.write(content)
 
-def append_file(file, content):
-    with open(file, "a") as f:
-        f.write(content)
-
 def read_key_and_token(args):
     with open(args.key) as k:
         apikey = k.readline().strip("\n")
@@ -97,75 +272,607 @@ def clear_screen():
     elif os.name == 'nt':
         os.system('cls')
 
+# board and machine IDs are folded out of paths so requests group per endpoint
+def endpoint_name(method, path):
+    if path.startswith("http://") or path.startswith("https://"):
+        return method + " " + urlparse(path).netloc + " (file)"
+    return method + " " + re.sub(r"/\d+", "/{id}", path.split("?")[0])
+
+# records every api request (latency, bytes, status, retries) and named phases of a run when --profile
+# is on, every record is also kept as a chrome trace event, disabled it costs one attribute check
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.endpoints = {}
+        self.phases = {}
+        self.events = []
+
+    def trace_event(self, name, category, started, seconds, args=None):
+        self.events.append({"name": name, "cat": category, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                            "ts": round((started - self.started) * 1e6), "dur": round(seconds * 1e6), "args": args or {}})
+
+    def record_request(self, method, path, started, seconds, status_code, size, attempt):
+        endpoint = endpoint_name(method, path)
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {"latencies": [], "bytes": 0, "retries": 0, "errors": 0})
+            stats["latencies"].append(seconds)
+            stats["bytes"] += size
+            stats["retries"] += 1 if attempt > 0 else 0
+            stats["errors"] += 1 if status_code is None or status_code >= 400 else 0
+            self.trace_event(endpoint, "request", started, seconds, {"status": status_code, "bytes": size, "attempt": attempt})
+
+    def record_phase(self, name, started, seconds):
+        with self.lock:
+            total, count = self.phases.get(name, (0.0, 0))
+            self.phases[name] = (total + seconds, count + 1)
+            self.trace_event(name, "phase", started, seconds)
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_phase(name, started, time.perf_counter() - started)
+
+    def phase(self, name):
+        return self.timed(name) if self.enabled else contextlib.nullcontext()
+
+    def summary(self):
+        bucket_names = ["<" + (str(round(bucket * 1000)) + "ms" if bucket < 1 else str(bucket) + "s") for bucket in LATENCY_BUCKETS]
+        header = ["Endpoint", "Calls", "p50 ms", "p95 ms", "Max ms", "Bytes", "Retries", "Errors"] + bucket_names + [">=" + bucket_names[-1][1:]]
+        rows = []
+        for endpoint, stats in sorted(self.endpoints.items(), key=lambda item: -sum(item[1]["latencies"])):
+            latencies = sorted(stats["latencies"])
+            histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+            for latency in latencies:
+                histogram[bisect.bisect_right(LATENCY_BUCKETS, latency)] += 1
+            rows.append([endpoint, len(latencies), round(latencies[len(latencies) // 2] * 1000), round(latencies[int(len(latencies) * 0.95)] * 1000),
+                         round(latencies[-1] * 1000), format_bytes(stats["bytes"]), stats["retries"], stats["errors"]] + histogram)
+        lines = ["\n\033[1mProfile: " + str(round(time.perf_counter() - self.started, 2)) + "s wall\033[0m\n"]
+        if rows:
+            lines.append(render_table([header] + rows))
+        phase_rows = [[name, count, round(total, 3)] for name, (total, count) in sorted(self.phases.items(), key=lambda item: -item[1][0])]
+        if phase_rows:
+            lines.append("phase times are summed over all threads and overlap when nested (a command includes its api calls, json decode etc)\n")
+            lines.append(render_table([["Phase", "Count", "Total s"]] + phase_rows))
+        return "\n".join(lines)
+
+    def write_trace(self, path):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+profiler = Profiler()
+
+# orjson when it is installed (several times faster on fleet sized board lists), json otherwise
+def decode_json(content):
+    with profiler.phase("json decode"):
+        return orjson.loads(content) if orjson is not None else json.loads(content)
+
+def ui_pause(seconds):
+    with profiler.phase("ui animation"):
+        time.sleep(seconds)
+
+# on-disk cache for slow changing GET responses (machines, applications)
+# entries are revalidated with If-None-Match / If-Modified-Since once their TTL expires
+class ResponseCache:
+    def __init__(self, directory, max_bytes, enabled=True, refresh=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.refresh = refresh
+        if self.enabled:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+
+    def paths(self, api, url):
+        key = hashlib.sha256((str(api.apikey) + " " + url).encode()).hexdigest()
+        return os.path.join(self.directory, key + ".body"), os.path.join(self.directory, key + ".meta")
+
+    def read_meta(self, meta_path):
+        try:
+            with open(meta_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_atomic(self, path, content, mode):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, mode) as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def get_json(self, api, path, ttl):
+        if not self.enabled:
+            return decode_json(api.request("GET", path).content)
+        url = api.base_url + path
+        body_path, meta_path = self.paths(api, url)
+        meta = self.read_meta(meta_path)
+        if meta is not None and not os.path.exists(body_path):
+            meta = None
+        if meta is not None and not self.refresh and time.time() - meta['fetched'] < ttl:
+            os.utime(meta_path)
+            with open(body_path, "rb") as f:
+                return decode_json(f.read())
+
+        conditional_headers = {}
+        if meta is not None and meta.get('etag'):
+            conditional_headers['If-None-Match'] = meta['etag']
+        if meta is not None and meta.get('last_modified'):
+            conditional_headers['If-Modified-Since'] = meta['last_modified']
+        response = api.request("GET", path, headers=conditional_headers)
+
+        if response.status_code == 304 and meta is not None:
+            meta['fetched'] = time.time()
+            self.write_atomic(meta_path, json.dumps(meta), "w")
+            with open(body_path, "rb") as f:
+                return decode_json(f.read())
+        if response.status_code == 200:
+            self.write_atomic(body_path, response.content, "wb")
+            self.write_atomic(meta_path, json.dumps({
+                "url"           : url,
+                "fetched"       : time.time(),
+                "etag"          : response.headers.get('ETag'),
+                "last_modified" : response.headers.get('Last-Modified')
+            }), "w")
+            self.evict()
+        return decode_json(response.content)
+
+    # least recently used entries are dropped until the cache fits in max_bytes
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".body"):
+                continue
+            body_path = os.path.join(self.directory, name)
+            meta_path = body_path[:-len(".body")] + ".meta"
+            try:
+                size = os.path.getsize(body_path)
+                last_used = os.path.getmtime(meta_path)
+            except OSError:
+                last_used = 0
+                size = 0
+            entries.append((last_used, size, body_path, meta_path))
+            total += size
+        for last_used, size, body_path, meta_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for path in (body_path, meta_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+# token bucket (rate per second, one second of burst) plus an AIMD concurrency limit per endpoint class:
+# throttled responses (429/503) halve both the rate and the requests allowed in flight (once per cooldown),
+# every other response adds 1/limit back so the limit climbs by ~1 per round trip while the api is healthy,
+# and the rate grows by 1 per response (doubling about every second) while requests are waiting on tokens,
+# so it only outgrows the rate the concurrency limit can actually use by a little. Retry-After pauses the whole class
+class AdaptiveLimiter:
+    def __init__(self, name, rate, max_concurrency):
+        self.name = name
+        self.rate = rate
+        self.tokens = max(1.0, rate)
+        self.rate_bound = False
+        self.updated = time.monotonic()
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if self.rate:
+                    self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                wait = self.paused_until - now
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    if not self.rate or self.tokens >= 1:
+                        self.tokens -= 1 if self.rate else 0
+                        self.in_flight += 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                    self.rate_bound = True
+                self.condition.wait(wait if wait > 0 else None)
+
+    def release(self, status_code):
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if status_code in THROTTLE_STATUS_CODES:
+                if now - self.last_decrease > AIMD_COOLDOWN:
+                    self.limit = max(1.0, self.limit * AIMD_DECREASE)
+                    if self.rate:
+                        self.rate = max(MIN_RATE, self.rate * AIMD_DECREASE)
+                        self.tokens = min(self.tokens, self.rate)
+                    self.last_decrease = now
+                    print("!!! api is throttling " + self.name + "s (" + str(status_code) + "), down to " + str(int(self.limit)) + " in flight" +
+                          (" and " + str(round(self.rate, 1)) + "/s" if self.rate else ""), file=sys.stderr)
+            elif status_code is not None:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+                if self.rate and self.rate_bound:
+                    self.rate += 1
+                    self.rate_bound = False
+            self.condition.notify_all()
+
+    def pause(self, seconds):
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.condition.notify_all()
+
+def retry_after_seconds(response):
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = (parsedate_to_datetime(value) - datetime.now(pytz.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0), RETRY_AFTER_MAX)
+
+# single client for every api call: pooled keep-alive connections, bounded timeouts and
+# retries on throttled (429) / server side (5xx) failures with exponential backoff + jitter
+class ApiClient:
+    def __init__(self, apikey, authtoken, base_url=API_BASE_URL, pool_size=8, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), cache=None, limits=None):
+        self.apikey = apikey
+        self.limits = limits or {}
+        self.base_url = base_url
+        self.headers = {'Authorization' : str(authtoken), 'x-api-key': str(apikey)}
+        self.timeout = timeout
+        self.cache = cache
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    # relative paths go to the api with auth headers and through the read / write limiter,
+    # absolute urls (s3 log files) are fetched bare
+    def request(self, method, path, headers=None, **kwargs):
+        if path.startswith("http://") or path.startswith("https://"):
+            url = path
+            request_headers = {}
+            limiter = None
+        else:
+            url = self.base_url + path
+            request_headers = dict(self.headers)
+            limiter = self.limits.get("read" if method == "GET" else "write")
+        if headers:
+            request_headers.update(headers)
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(MAX_RETRIES + 1):
+            if limiter is not None:
+                with profiler.phase("rate limit wait (" + limiter.name + ")"):
+                    limiter.acquire()
+            status_code = None
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, headers=request_headers, **kwargs)
+                status_code = response.status_code
+                if profiler.enabled:
+                    size = int(response.headers.get('Content-Length', 0)) if kwargs.get('stream') else len(response.content)
+                    profiler.record_request(method, path, started, time.perf_counter() - started, status_code, size, attempt)
+                if status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+                    return response
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if profiler.enabled:
+                    profiler.record_request(method, path, started, time.perf_counter() - started, None, 0, attempt)
+                if attempt == MAX_RETRIES:
+                    raise
+            finally:
+                if limiter is not None:
+                    limiter.release(status_code)
+            retry_after = retry_after_seconds(response) if status_code in THROTTLE_STATUS_CODES else None
+            if retry_after is not None and limiter is not None:
+                limiter.pause(retry_after)
+                continue
+            with profiler.phase("retry backoff"):
+                time.sleep(retry_after if retry_after is not None else BACKOFF_BASE * (2 ** attempt) + random.uniform(0, BACKOFF_BASE))
+
+    def get_json(self, path, params=None):
+        return decode_json(self.request("GET", path, params=params).content)
+
+    def get_cached_json(self, path, ttl):
+        if self.cache is None:
+            return self.get_json(path)
+        return self.cache.get_json(self, path, ttl)
+
+    def get_machines(self, params=None):
+        path = "/machine?" + urlencode(params) if params else "/machine"
+        return self.get_cached_json(path, CACHE_TTLS['machine'])
+
+    def get_applications(self):
+        return self.get_cached_json("/application", CACHE_TTLS['application'])
+
+    def get_boards(self, machine_id):
+        return self.request("GET", "/board", params={'machineId': machine_id})
+
+    def put_board(self, board):
+        return self.request("PUT", "/board/" + str(board['id']), json=board)
+
+    def get_logs(self, machine_id, count, page=None):
+        params = {'machineId': machine_id, 'count': count}
+        if page is not None:
+            params['page'] = page
+        return self.get_json("/log", params=params)
+
+    def download(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+api = None
+
+# one thread pool behind every fan-out (boards, logs, updates across the fleet), created once per run:
+# its size caps requests in flight, request starts are spaced per host and Ctrl-C cancels everything queued.
+# api calls are blocking requests calls, so fn must not fan out through the engine itself
+class FanOutEngine:
+    def __init__(self, max_in_flight, host_rate):
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="fan-out")
+        self.host_rate = host_rate
+        self.next_start = {}
+        self.lock = threading.Lock()
+
+    def host_slot(self, host):
+        if not self.host_rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start.get(host, now))
+            self.next_start[host] = start + 1 / self.host_rate
+        if start > now:
+            time.sleep(start - now)
+
+    def call(self, host, fn, item):
+        self.host_slot(host)
+        return fn(item)
+
+    # fn(item) for every item, on_result(item, result) is called in item order as results come in,
+    # exceptions listed in errors are passed as the result, anything else cancels the run and is raised
+    def run(self, fn, items, on_result, errors=(), host=None):
+        default_host = urlparse(api.base_url).netloc
+        futures = [(item, self.executor.submit(self.call, host(item) if host else default_host, fn, item)) for item in items]
+        try:
+            for item, future in futures:
+                try:
+                    result = future.result()
+                except errors as e:
+                    result = e
+                on_result(item, result)
+        finally:
+            for item, future in futures:
+                future.cancel()
+
+    def map(self, fn, items, errors=(), host=None):
+        results = []
+        self.run(fn, items, lambda item, result: results.append(result), errors, host)
+        return results
+
+engine = None
+
 def get_list_of_all_machines():
-    headers = {'Authorization' : str(authtoken), 'x-api-key': str(apikey)}
-    url = "https://api.backbar.com/machine"
-    response = requests.request("GET", url, headers=headers)
-    machine_info = json.loads(response.text)
-    return machine_info
+    return get_machine_index().machines
 
 def print_machine_info(machine):
-    print(machine['name'])
-    print("   ID: " + str(machine['id']))
-    print("   Serial Number: " + str(machine['serialNumber']) + "\n")
+    print(machine.name)
+    print("   ID: " + str(machine.id))
+    print("   Serial Number: " + machine.serial + "\n")
 
 def print_app_info(app):
-    print("Target: " + str(app['type']['name']) + " || Version: " + str(app['fwMajor']) + "." + str(app['fwMinor']) + "." + str(app['fwPatch']) + ' || Notes: ' + str(app['notes']))
-    print("   URL: " + str(app['filePath']))
+    print("Target: " + str(app.target) + " || Version: " + app.version_str + ' || Notes: ' + str(app.notes))
+    print("   URL: " + str(app.file_path))
     print("\n")
 
 def wait_for_specific_input(expected_input):
     while True:
-        user_input = input(f"Enter '{expected_input}' to continue if selected option(s) are OK ('q' to quit): ")
+        with profiler.phase("user input"):
+            user_input = input(f"Enter '{expected_input}' to continue if selected option(s) are OK ('q' to quit): ")
         if user_input.lower() == expected_input.lower():
             break
         if user_input.lower() == 'q':
             quit()
 
+# full /application list indexed by target and notes, each index sorted by version (oldest first)
+class AppCatalog:
+    def __init__(self, apps):
+        self.apps = apps
+        self.by_target = {}
+        self.by_notes = {}
+        self.by_target_and_notes = {}
+        for app in sorted(apps, key=lambda app: app.version):
+            target_key = catalog_key(app.target)
+            notes_key = app.notes or ""
+            self.by_target.setdefault(target_key, []).append(app)
+            self.by_notes.setdefault(notes_key, []).append(app)
+            self.by_target_and_notes.setdefault((target_key, notes_key), []).append(app)
+
+    def get(self, target, notes):
+        notes_key = "" if notes == "PROD" else notes
+        if target and notes is not None:
+            apps = self.by_target_and_notes.get((catalog_key(target), notes_key), [])
+        elif target:
+            apps = self.by_target.get(catalog_key(target), [])
+        elif notes is not None:
+            apps = self.by_notes.get(notes_key, [])
+        else:
+            apps = self.apps
+        return list(apps)
+
+app_catalog = None
+
+def get_app_catalog():
+    global app_catalog
+    if app_catalog is None:
+        app_catalog = AppCatalog([App(app) for app in api.get_applications()])
+    return app_catalog
+
 def get_list_of_apps(target, notes):
-    headers = {'Authorization' : str(authtoken), 'x-api-key': str(apikey)}
-    url = "https://api.backbar.com/application"
-    response = requests.request("GET", url, headers=headers)
-    apps = json.loads(response.text)
-    if target:
-        apps = [item for item in apps if item['type'].get('name').lower() == target.lower()]
-    if notes is not None and notes == "PROD":
-        apps = [item for item in apps if item['notes'] == ""]
-    elif notes is not None:
-        apps = [item for item in apps if item['notes'] == notes]
-    return apps
+    return get_app_catalog().get(target, notes)
 
 def list_latest_apps(args):
     print('\nRetrieving list of most recently deployed applications...\n')
-    apps = get_list_of_apps(args.target, None)
+    apps = get_app_catalog().get(args.target, None)
     for app in apps[-10:]:
         print_app_info(app)
 
+def org_key(name):
+    return str(name).lower()
+
+def parse_id_ranges(id_ranges):
+    ranges = []
+    for id_range in id_ranges:
+        for part in id_range.split(","):
+            low, sep, high = part.partition("-")
+            try:
+                ranges.append((int(low), int(high) if sep else int(low)))
+            except ValueError:
+                print("Error: invalid machine ID range '" + part + "' (use 80-120 or 90)")
+                sys.exit(1)
+    return ranges
+
+# full /machine list indexed by ID, serial, org and name so combined filters are set intersections
+# names are kept sorted for prefix lookups and split into trigrams for substring lookups
+class MachineIndex:
+    def __init__(self, machines):
+        self.machines = machines
+        self.by_id = {}
+        self.by_serial = {}
+        self.by_org = {}
+        self.by_trigram = {}
+        self.names = sorted((machine.name, position) for position, machine in enumerate(machines))
+        for position, machine in enumerate(machines):
+            self.by_id[machine.id] = position
+            self.by_serial[machine.serial] = position
+            self.by_org.setdefault(org_key(machine.org), set()).add(position)
+            name = machine.name
+            for i in range(len(name) - 2):
+                self.by_trigram.setdefault(name[i:i + 3], set()).add(position)
+
+    def get(self, machine_id):
+        position = self.by_id.get(machine_id)
+        return self.machines[position] if position is not None else None
+
+    def org(self, orgs):
+        return set().union(*(self.by_org.get(org_key(org), set()) for org in orgs))
+
+    def ids(self, id_ranges):
+        return {position for machine_id, position in self.by_id.items() if any(low <= machine_id <= high for low, high in id_ranges)}
+
+    def serials(self, serials):
+        return {self.by_serial[serial] for serial in serials if serial in self.by_serial}
+
+    def name_prefix(self, prefix):
+        positions = set()
+        for name, position in self.names[bisect.bisect_left(self.names, (prefix,)):]:
+            if not name.startswith(prefix):
+                break
+            positions.add(position)
+        return positions
+
+    def name_contains(self, substring, candidates=None):
+        if len(substring) >= 3:
+            trigrams = [self.by_trigram.get(substring[i:i + 3], set()) for i in range(len(substring) - 2)]
+            candidates = set.intersection(*trigrams) if candidates is None else candidates.intersection(*trigrams)
+        elif candidates is None:
+            candidates = range(len(self.machines))
+        return {position for position in candidates if substring in self.machines[position].name}
+
+    def name_regex(self, pattern, candidates=None):
+        try:
+            regex = re.compile(pattern)
+        except re.error as e:
+            print("Error: invalid name regex '" + pattern + "': " + str(e))
+            sys.exit(1)
+        if candidates is None:
+            candidates = range(len(self.machines))
+        return {position for position in candidates if regex.search(self.machines[position].name)}
+
+    # every given filter must match (AND), machines come back in api order
+    def select(self, orgs=None, id_ranges=None, serials=None, name_contains=None, name_prefix=None, name_regex=None):
+        positions = None
+        for matched in (self.org(orgs) if orgs else None,
+                        self.ids(id_ranges) if id_ranges else None,
+                        self.serials(serials) if serials else None,
+                        self.name_prefix(name_prefix) if name_prefix else None):
+            if matched is not None:
+                positions = matched if positions is None else positions & matched
+        if name_contains:
+            positions = self.name_contains(name_contains, positions)
+        if name_regex:
+            positions = self.name_regex(name_regex, positions)
+        if positions is None:
+            return list(self.machines)
+        return [self.machines[position] for position in sorted(positions)]
+
+machine_indexes = {}
+
+def get_machine_index(params=None):
+    key = tuple(sorted((params or {}).items()))
+    if key not in machine_indexes:
+        machines = api.get_machines(params)
+        if params and not isinstance(machines, list):
+            print("!!! api did not accept machine query params, filtering the full machine list instead")
+            machines = api.get_machines()
+        machine_indexes[key] = MachineIndex([Machine(machine) for machine in machines])
+    return machine_indexes[key]
+
+def machine_filter_orgs(args):
+    orgs = list(args.org or [])
+    if args.gregorys:
+        orgs.append('Gregorys Coffee')
+    if args.backbar:
+        orgs.append('BackBar')
+    return orgs
+
+def has_machine_filter(args):
+    return bool(machine_filter_orgs(args) or args.name_filter or args.name_prefix or args.name_regex or args.id_range or args.serial)
+
+def describe_machine_filter(args):
+    filters = []
+    orgs = machine_filter_orgs(args)
+    if orgs:
+        filters.append("org " + " or ".join("'" + org + "'" for org in orgs))
+    if args.name_filter:
+        filters.append("name containing '" + args.name_filter + "'")
+    if args.name_prefix:
+        filters.append("name starting with '" + args.name_prefix + "'")
+    if args.name_regex:
+        filters.append("name matching '" + args.name_regex + "'")
+    if args.id_range:
+        filters.append("ID in " + ", ".join(args.id_range))
+    if args.serial:
+        filters.append("serial " + ", ".join(args.serial))
+    return " and ".join(filters)
+
+# org / name filters go to the api as query params with --server-filter, the index always
+# applies every filter again so results don't depend on what the api supports
+def find_machines(args):
+    params = {}
+    orgs = machine_filter_orgs(args)
+    if args.server_filter:
+        if len(orgs) == 1:
+            params['organization'] = orgs[0]
+        if args.name_filter:
+            params['name'] = args.name_filter
+    id_ranges = parse_id_ranges(args.id_range) if args.id_range else None
+    return get_machine_index(params).select(orgs=orgs, id_ranges=id_ranges, serials=args.serial, name_contains=args.name_filter,
+                                            name_prefix=args.name_prefix, name_regex=args.name_regex)
+
 def list_all_machines(args):
     print('\nRetrieving all machines...\n')
-    machine_info = get_list_of_all_machines()
-    for machine in machine_info:
-        if args.gregorys:
-            if (machine['location']['organization']['name'] == 'Gregorys Coffee'):
-                print_machine_info(machine)
-        elif args.backbar:
-            if (machine['location']['organization']['name'] == 'BackBar'):
-                print_machine_info(machine)
-        elif args.name_filter:
-            if (args.name_filter in machine['name']):
-                print_machine_info(machine)
-        else:
-            print_machine_info(machine)
+    for machine in find_machines(args):
+        print_machine_info(machine)
 
 def list_logs(args):
     print("\nRetrieving most recent logs from Machine ID " + str(args.list_logs) + "...\n")
-    headers = {'Authorization' : str(authtoken), 'x-api-key': str(apikey)}
-    payload = {}
-    url = "https://api.backbar.com/log?machineId="
-    url += str(args.list_logs)
-    url += "&count=10"
-    response = requests.request("GET", url, headers=headers, data=payload)
-    logfiles = json.loads(response.text)
+    logfiles = api.get_logs(args.list_logs, 10)
 
     menu_title = "~ ~ select log(s) you want to download (press 'space' to select, 'enter' to confirm, 'q' to quit) ~ ~\n"
     menu_items = []
@@ -183,73 +890,458 @@ def list_logs(args):
     )
 
     menu_entry_indexes = terminal_menu.show()
-    for menu_entry_index in menu_entry_indexes:
-        if menu_entry_index is not None and menu_entry_index < len(logfiles['data']):
-            selected_log = logfiles['data'][menu_entry_index]
-            log = requests.request("GET", selected_log['fileUrl'])
-            write_file(selected_log['fileName'], log.text)
-            print("*** Log saved to " + selected_log['fileName'] + " ***\n")
-
-# TODO: adjust argparse to take n parameters and print status for n machines
-def get_machine_status(args, f):
-    print("\nRetrieving firmware status for Machine ID " + str(args.machine_status) + "...\n", file=f)
-    headers = {'Authorization' : str(authtoken), 'x-api-key': str(apikey)}
-    url = "https://api.backbar.com/board?machineId="
-    url += str(args.machine_status)
-    response = requests.request("GET", url, headers=headers)
-    boards_full_info = json.loads(response.text)
-    machine_name = boards_full_info[0]['machine']['name']
-    
-    boards_status = [
-        ["Target", "PCB Version", "Status", "Current FW", "Queued FW", "Previous FW"]
-    ]
+    if menu_entry_indexes is None:
+        print("No option selected, quitting...\n")
+        return
+    selected_logs = [logfiles['data'][index] for index in menu_entry_indexes if index < len(logfiles['data'])]
+    download_logs(selected_logs)
 
-    for board in boards_full_info:
-        if board['scheduled'] == None:
-            queued = "N/A"
+def format_bytes(num_bytes):
+    for unit in ["B", "KB", "MB"]:
+        if num_bytes < 1024:
+            return str(round(num_bytes, 1)) + " " + unit
+        num_bytes /= 1024
+    return str(round(num_bytes, 1)) + " GB"
+
+def load_log_etags():
+    try:
+        with open(LOG_ETAGS_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_log_etags(etags):
+    write_file(LOG_ETAGS_FILE, json.dumps(etags, indent=2))
+
+# streams a log file to disk in chunks, skipping it if the local copy matches the remote etag or size
+def download_log(log, etag=None):
+    path = log['fileName']
+    headers = {'If-None-Match': etag} if etag and os.path.exists(path) else None
+    start = time.time()
+    with api.download(log['fileUrl'], headers=headers, stream=True) as response:
+        if response.status_code == 304:
+            return {"file": path, "status": "skipped", "bytes": 0, "seconds": 0, "etag": etag}
+        response.raise_for_status()
+        remote_size = response.headers.get('Content-Length')
+        if remote_size is not None and os.path.exists(path) and os.path.getsize(path) == int(remote_size):
+            return {"file": path, "status": "skipped", "bytes": 0, "seconds": 0, "etag": response.headers.get('ETag')}
+        written = 0
+        with open(path + ".part", "wb") as f:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                written += len(chunk)
+        os.replace(path + ".part", path)
+        return {"file": path, "status": "downloaded", "bytes": written, "seconds": time.time() - start, "etag": response.headers.get('ETag')}
+
+def download_logs(logs):
+    etags = load_log_etags()
+    start = time.time()
+    results = []
+
+    def save_result(log, result):
+        if isinstance(result, Exception):
+            print("!!! Failed to download " + log['fileName'] + ": " + str(result) + "\n")
+            return
+        if result['status'] == "skipped":
+            print("*** " + result['file'] + " already up to date, skipped ***\n")
         else:
-            queued = str(board['scheduled']['fwMajor']) + "." + str(board['scheduled']['fwMinor']) + "." + str(board['scheduled']['fwPatch']) + " " + str(board['scheduled']['notes'])
-        if board['type']['name'] == "Pump":
-            board_num = "" + str(board['protocolId'])
+            rate = result['bytes'] / max(result['seconds'], 0.001)
+            print("*** Log saved to " + result['file'] + " (" + format_bytes(result['bytes']) + ", " + format_bytes(rate) + "/s) ***\n")
+        if result['etag']:
+            etags[result['file']] = result['etag']
+        results.append(result)
+    engine.run(lambda log: download_log(log, etags.get(log['fileName'])), logs, save_result,
+               errors=(requests.exceptions.RequestException, OSError), host=lambda log: urlparse(log['fileUrl']).netloc)
+    save_log_etags(etags)
+
+    elapsed = time.time() - start
+    downloaded = [result for result in results if result['status'] == "downloaded"]
+    total_bytes = sum(result['bytes'] for result in downloaded)
+    print("Downloaded " + str(len(downloaded)) + " file(s), skipped " + str(len(results) - len(downloaded)) +
+          ", failed " + str(len(logs) - len(results)) + " -- " + format_bytes(total_bytes) + " in " +
+          str(round(elapsed, 2)) + "s (" + format_bytes(total_bytes / max(elapsed, 0.001)) + "/s)\n")
+    return results
+
+def open_log_manifest(archive_dir):
+    os.makedirs(archive_dir, exist_ok=True)
+    db = sqlite3.connect(os.path.join(archive_dir, LOG_MANIFEST_FILE))
+    db.execute("""CREATE TABLE IF NOT EXISTS logs (
+                      machine_id   INTEGER NOT NULL,
+                      file_name    TEXT NOT NULL,
+                      add_dt       TEXT,
+                      path         TEXT NOT NULL,
+                      bytes        INTEGER,
+                      stored_bytes INTEGER,
+                      etag         TEXT,
+                      synced_at    REAL,
+                      PRIMARY KEY (machine_id, file_name))""")
+    db.execute("CREATE INDEX IF NOT EXISTS logs_add_dt ON logs (add_dt)")
+    # logs whose download failed, the next sync pages back far enough to retry them
+    db.execute("""CREATE TABLE IF NOT EXISTS failed (
+                      machine_id   INTEGER NOT NULL,
+                      file_name    TEXT NOT NULL,
+                      error        TEXT,
+                      failed_at    REAL,
+                      PRIMARY KEY (machine_id, file_name))""")
+    return db
+
+# /log is newest first, paging stops at the first page that is already fully archived once every
+# earlier failure (retry) has been seen again
+def list_new_logs(machine_id, archived, retry=()):
+    new_logs = []
+    seen = set()
+    page = 1
+    while True:
+        logfiles = api.get_logs(machine_id, LOG_PAGE_SIZE, page=page)
+        entries = [log for log in logfiles['data'] if log['fileName'] not in seen]
+        if not entries:
+            break
+        seen.update(log['fileName'] for log in entries)
+        fresh = [log for log in entries if log['fileName'] not in archived]
+        new_logs.extend(fresh)
+        if len(logfiles['data']) < LOG_PAGE_SIZE:
+            break
+        if not fresh and all(file_name in seen for file_name in retry):
+            break
+        page += 1
+    return new_logs
+
+def archive_log(log, machine_id, archive_dir):
+    day = str(log['addDT'])[:10].replace(os.sep, "-") or "unknown-date"
+    directory = os.path.join(archive_dir, str(machine_id), day)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, os.path.basename(log['fileName']) + ".gz")
+    written = 0
+    with api.download(log['fileUrl'], stream=True) as response:
+        response.raise_for_status()
+        with open(path + ".part", "wb") as f:
+            with gzip.GzipFile(filename=os.path.basename(log['fileName']), mode="wb", fileobj=f) as gz:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    gz.write(chunk)
+                    written += len(chunk)
+        etag = response.headers.get('ETag')
+    os.replace(path + ".part", path)
+    return (machine_id, log['fileName'], str(log['addDT']), path, written, os.path.getsize(path), etag, time.time())
+
+def sync_machine_logs(machine_id, archived, retry, archive_dir):
+    rows = []
+    errors = []
+    for log in list_new_logs(machine_id, archived, retry):
+        try:
+            rows.append(archive_log(log, machine_id, archive_dir))
+        except (requests.exceptions.RequestException, OSError) as e:
+            errors.append((log['fileName'], str(e)))
+    return rows, errors
+
+def sync_logs(args):
+    machine_ids = select_machine_ids(args.sync_logs, args)
+    print("\nSyncing logs for " + str(len(machine_ids)) + " machine(s) into " + args.archive_dir + "...\n")
+    db = open_log_manifest(args.archive_dir)
+    archived = {}
+    for machine_id, file_name in db.execute("SELECT machine_id, file_name FROM logs"):
+        archived.setdefault(machine_id, set()).add(file_name)
+    retry = {}
+    for machine_id, file_name in db.execute("SELECT machine_id, file_name FROM failed"):
+        retry.setdefault(machine_id, set()).add(file_name)
+
+    start = time.time()
+    total_files = 0
+    total_bytes = 0
+    failed = 0
+
+    def save_machine(machine_id, result):
+        nonlocal total_files, total_bytes, failed
+        if isinstance(result, Exception):
+            # the log list itself failed, earlier failures stay queued for the next run
+            rows, errors = [], [("log list", str(result))]
         else:
-            board_num = ""
-        boards_status.append([
-            board['type']['name'] + " " + str(board_num),
-            str(board['pcbMajor']) + "." + str(board['pcbMinor']) + "." + str(board['pcbPatch']),
-            board['status'],
-            str(board['application']['fwMajor']) + "." + str(board['application']['fwMinor']) + "." + str(board['application']['fwPatch']) + " " + str(board['application']['notes']),
-            queued,
-            str(board['previous']['fwMajor']) + "." + str(board['previous']['fwMinor']) + "." + str(board['previous']['fwPatch']) + " " + str(board['previous']['notes'])
-        ])
-    
-    col_widths = [max(len(str(item)) for item in col) for col in zip(*boards_status)]
-    header = boards_status[0]
-
-    print("*  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  * ", file=f)
-    print("Application status for: " + machine_name, file=f)
-    print("*  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  * \n ", file=f)
-
-    for i, item in enumerate(header):
-        print(item.ljust(col_widths[i] + 4), end="", file=f)
-    print("",file=f)
-    for width in col_widths:
-        print('-' * (width + 4), end="", file=f)
-    print("", file=f)
-    for row in boards_status[1:]:
-        for i, item in enumerate(row):
-            print(item.ljust(col_widths[i] + 4), end="", file=f) 
-        print("", file=f)
-    print("", file=f)
-    
+            rows, errors = result
+            db.execute("DELETE FROM failed WHERE machine_id = ?", (machine_id,))
+            db.executemany("INSERT OR REPLACE INTO failed VALUES (?, ?, ?, ?)",
+                           [(machine_id, file_name, error, time.time()) for file_name, error in errors])
+        db.executemany("INSERT OR REPLACE INTO logs VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        db.commit()
+        machine_bytes = sum(row[4] for row in rows)
+        print("* Machine " + str(machine_id) + ": " + str(len(rows)) + " new file(s), " + format_bytes(machine_bytes))
+        for file_name, error in errors:
+            print("     !!! " + file_name + ": " + error)
+        total_files += len(rows)
+        total_bytes += machine_bytes
+        failed += len(errors)
+    engine.run(lambda machine_id: sync_machine_logs(machine_id, archived.get(machine_id, set()), retry.get(machine_id, set()), args.archive_dir),
+               machine_ids, save_machine,
+               errors=(requests.exceptions.RequestException, ValueError, KeyError))
+    db.close()
+    print("\nSynced " + str(total_files) + " new file(s), " + format_bytes(total_bytes) + " in " +
+          str(round(time.time() - start, 2)) + "s, " + str(failed) + " failure(s)\n")
+
+def select_machine_ids(machine_ids, args):
+    if machine_ids:
+        return machine_ids
+    if has_machine_filter(args):
+        return [machine.id for machine in find_machines(args)]
+    print("Error: pass machine ID(s) or a machine filter (--gregorys, --backbar, --org, --name-filter, --name-prefix, --name-regex, --id-range, --serial)")
+    sys.exit(1)
+
+def get_machine_status(args, f):
+    machine_ids = select_machine_ids(args.machine_status, args)
+    if args.format == "table":
+        print("\nRetrieving firmware status for " + str(len(machine_ids)) + " machine(s)...\n", file=f)
+
+    all_boards = fetch_fleet_boards(machine_ids)
+    rows = []
+    for machine_id, boards_full_info in zip(machine_ids, all_boards):
+        if isinstance(boards_full_info, Exception):
+            rows.append([machine_status_name(machine_id, []), str(machine_id), "-", "-", "ERROR: " + str(boards_full_info), "-", "-", "-"])
+            continue
+        machine_name = machine_status_name(machine_id, boards_full_info)
+        for row in board_status_rows(boards_full_info):
+            rows.append([machine_name, str(machine_id)] + row)
+
+    print_rows(["Machine", "ID"] + BOARD_STATUS_HEADER, rows, args.format, f)
+
+def decode_boards(content, keep_raw=False):
+    boards = decode_json(content)
+    if not isinstance(boards, list):
+        raise ValueError("expected a board list, got " + str(boards)[:200])
+    return [Board(board, keep_raw) for board in boards]
+
+def get_machine_boards(machine_id):
+    return decode_boards(api.get_boards(machine_id).content)
+
+# boards for many machines fetched concurrently, failures are returned in place of the board list
+def fetch_fleet_boards(machine_ids):
+    return engine.map(get_machine_boards, machine_ids, errors=(requests.exceptions.RequestException, ValueError))
+
+def machine_status_name(machine_id, boards_full_info):
+    if boards_full_info and isinstance(boards_full_info, list):
+        return boards_full_info[0].machine_name
+    return "Machine " + str(machine_id)
+
+BOARD_STATUS_HEADER = ["Target", "PCB Version", "Status", "Current FW", "Queued FW", "Previous FW"]
+
+def board_status_rows(boards_full_info):
+    rows = []
+    for board in boards_full_info:
+        rows.append([board.label, board.pcb_version, board.status, format_app_version(board.application),
+                     format_app_version(board.scheduled), format_app_version(board.previous)])
+    return rows
+
+# whole table is built as one string so it is written in a single call
+def render_table(table):
+    col_widths = [max(len(str(item)) for item in col) for col in zip(*table)]
+    lines = ["".join(str(item).ljust(col_widths[i] + 4) for i, item in enumerate(table[0]))]
+    lines.append("".join('-' * (width + 4) for width in col_widths))
+    for row in table[1:]:
+        lines.append("".join(str(item).ljust(col_widths[i] + 4) for i, item in enumerate(row)))
+    return "\n".join(lines) + "\n"
+
+# --format output shared by every tabular command
+def print_rows(header, rows, fmt, f=None):
+    if fmt == "csv":
+        writer = csv.writer(f if f is not None else sys.stdout)
+        writer.writerow(header)
+        writer.writerows(rows)
+    elif fmt == "json":
+        print(json.dumps([dict(zip(header, row)) for row in rows], indent=2), file=f)
+    else:
+        print(render_table([header] + rows), file=f)
+
+def print_machine_status(boards_full_info, f):
+    machine_name = boards_full_info[0].machine_name
+    print("*  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  * \n" +
+          "Application status for: " + machine_name + "\n" +
+          "*  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  *  * \n \n" +
+          render_table([BOARD_STATUS_HEADER] + board_status_rows(boards_full_info)), file=f)
+
+# board state is stored as history: every row is valid from the snapshot it was first seen in until
+# the snapshot it changed or disappeared in (valid_to), so a snapshot only writes what changed and
+# the current fleet is the rows with valid_to IS NULL
+def open_snapshot_db(path):
+    db = sqlite3.connect(path)
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS snapshots (
+            id        INTEGER PRIMARY KEY AUTOINCREMENT,
+            taken_at  REAL NOT NULL,
+            machines  INTEGER,
+            boards    INTEGER,
+            changes   INTEGER);
+        CREATE TABLE IF NOT EXISTS machine_state (
+            machine_id  INTEGER NOT NULL,
+            name        TEXT,
+            serial      TEXT,
+            org         TEXT,
+            valid_from  INTEGER NOT NULL,
+            valid_to    INTEGER);
+        CREATE TABLE IF NOT EXISTS board_state (
+            board_id     INTEGER NOT NULL,
+            machine_id   INTEGER NOT NULL,
+            board_type   TEXT,
+            label        TEXT,
+            pcb_version  TEXT,
+            status       TEXT,
+            fw_major     INTEGER,
+            fw_minor     INTEGER,
+            fw_patch     INTEGER,
+            fw_notes     TEXT,
+            scheduled_fw TEXT,
+            previous_fw  TEXT,
+            valid_from   INTEGER NOT NULL,
+            valid_to     INTEGER);
+        CREATE INDEX IF NOT EXISTS machine_state_current ON machine_state (machine_id) WHERE valid_to IS NULL;
+        CREATE INDEX IF NOT EXISTS board_state_current ON board_state (board_id) WHERE valid_to IS NULL;
+        CREATE INDEX IF NOT EXISTS board_state_machine ON board_state (machine_id, valid_to);
+        CREATE INDEX IF NOT EXISTS board_state_fw ON board_state (board_type, fw_major, fw_minor, fw_patch) WHERE valid_to IS NULL;
+    """)
+    return db
+
+MACHINE_STATE_COLUMNS = ["name", "serial", "org"]
+BOARD_STATE_COLUMNS   = ["machine_id", "board_type", "label", "pcb_version", "status", "fw_major", "fw_minor", "fw_patch", "fw_notes", "scheduled_fw", "previous_fw"]
+
+def machine_state_row(machine):
+    return (machine.name, machine.serial, machine.org)
+
+def board_state_row(board):
+    major, minor, patch = board.application.version if board.application else (None, None, None)
+    return (board.machine_id, board.type_name, board.label, board.pcb_version, board.status,
+            major, minor, patch, (board.application.notes if board.application else None) or "",
+            format_app_version(board.scheduled), format_app_version(board.previous))
+
+# closes rows that changed or disappeared (within the snapshot's machines) and inserts the new versions,
+# returns (key, old values, new values) per change with None for added / removed
+def apply_snapshot_rows(db, table, key, columns, rows, snapshot_id, machine_ids):
+    column = "machine_id" if table == "machine_state" else key
+    current = {row[0]: tuple(row[1:]) for row in db.execute("SELECT " + ", ".join([key] + columns) + " FROM " + table + " WHERE valid_to IS NULL")}
+    if table == "board_state":
+        current = {row_key: values for row_key, values in current.items() if values[0] in machine_ids}
+    else:
+        current = {row_key: values for row_key, values in current.items() if row_key in machine_ids}
+    changes = []
+    for row_key, values in rows.items():
+        old = current.get(row_key)
+        if old != values:
+            changes.append((row_key, old, values))
+    changes += [(row_key, old, None) for row_key, old in current.items() if row_key not in rows]
+    db.executemany("UPDATE " + table + " SET valid_to = ? WHERE " + column + " = ? AND valid_to IS NULL",
+                   [(snapshot_id, row_key) for row_key, old, new in changes if old is not None])
+    db.executemany("INSERT INTO " + table + " (" + ", ".join([key] + columns + ["valid_from"]) + ") VALUES (" + ", ".join("?" * (len(columns) + 2)) + ")",
+                   [(row_key,) + new + (snapshot_id,) for row_key, old, new in changes if new is not None])
+    return changes
+
+def describe_state_change(columns, old, new):
+    if old is None:
+        return "added"
+    if new is None:
+        return "removed"
+    old, new = dict(zip(columns, old)), dict(zip(columns, new))
+    if "fw_major" in old:
+        for values in (old, new):
+            values["fw"] = format_version((values.pop("fw_major"), values.pop("fw_minor"), values.pop("fw_patch")), values.pop("fw_notes"))
+    return "; ".join(column + " " + str(old[column]) + " -> " + str(new[column]) for column in new if old[column] != new[column])
+
+def snapshot(args):
+    full_fleet = not args.snapshot and not has_machine_filter(args)
+    if args.snapshot:
+        machine_ids = args.snapshot
+    elif has_machine_filter(args):
+        machine_ids = [machine.id for machine in find_machines(args)]
+    else:
+        machine_ids = [machine.id for machine in get_list_of_all_machines()]
+    machine_index = get_machine_index()
+    print("\nTaking a snapshot of " + str(len(machine_ids)) + " machine(s) into " + args.snapshot_db + "...\n")
+
+    start = time.time()
+    all_boards = fetch_fleet_boards(machine_ids)
+    fetched_ids = set()
+    board_rows = {}
+    for machine_id, boards_full_info in zip(machine_ids, all_boards):
+        if isinstance(boards_full_info, Exception):
+            print("!!! could not retrieve boards for Machine ID " + str(machine_id) + ", kept its previous state: " + str(boards_full_info))
+            continue
+        fetched_ids.add(machine_id)
+        for board in boards_full_info:
+            board_rows[board.id] = board_state_row(board)
+    machine_rows = {machine_id: machine_state_row(machine_index.get(machine_id)) for machine_id in fetched_ids if machine_index.get(machine_id)}
+
+    db = open_snapshot_db(args.snapshot_db)
+    with db:
+        previous = db.execute("SELECT id, taken_at FROM snapshots ORDER BY id DESC LIMIT 1").fetchone()
+        snapshot_id = db.execute("INSERT INTO snapshots (taken_at, machines, boards) VALUES (?, ?, ?)",
+                                 (time.time(), len(fetched_ids), len(board_rows))).lastrowid
+        # a full fleet snapshot also closes machines (and their boards) that are no longer in /machine
+        scope = set(fetched_ids)
+        if full_fleet:
+            listed_ids = set(machine_ids)
+            scope.update(machine_id for (machine_id,) in db.execute("SELECT machine_id FROM machine_state WHERE valid_to IS NULL "
+                                                                    "UNION SELECT machine_id FROM board_state WHERE valid_to IS NULL")
+                         if machine_id not in listed_ids)
+        machine_changes = apply_snapshot_rows(db, "machine_state", "machine_id", MACHINE_STATE_COLUMNS, machine_rows, snapshot_id, scope)
+        board_changes = apply_snapshot_rows(db, "board_state", "board_id", BOARD_STATE_COLUMNS, board_rows, snapshot_id, scope)
+        db.execute("UPDATE snapshots SET changes = ? WHERE id = ?", (len(machine_changes) + len(board_changes), snapshot_id))
+    names = {machine_id: name for machine_id, name in db.execute("SELECT machine_id, name FROM machine_state WHERE valid_to IS NULL OR valid_to = ?", (snapshot_id,))}
+    db.close()
+
+    header = ["Machine", "ID", "Board", "Change"]
+    rows = [[names.get(machine_id, "Machine " + str(machine_id)), str(machine_id), "-", describe_state_change(MACHINE_STATE_COLUMNS, old, new)]
+            for machine_id, old, new in machine_changes]
+    for board_id, old, new in board_changes:
+        machine_id, label = (new or old)[0], (new or old)[2]
+        rows.append([names.get(machine_id, "Machine " + str(machine_id)), str(machine_id), label, describe_state_change(BOARD_STATE_COLUMNS, old, new)])
+    rows.sort(key=lambda row: (row[0], row[2]))
+    if args.format != "table":
+        print_rows(header, rows, args.format)
+    else:
+        summary = "\033[1mSnapshot " + str(snapshot_id) + ": " + str(len(fetched_ids)) + " machine(s), " + str(len(board_rows)) + " board(s) in " + str(round(time.time() - start, 2)) + "s, "
+        if previous is None:
+            print(summary + "first snapshot, nothing to compare yet\033[0m\n")
+            return
+        print(summary + str(len(rows)) + " change(s) since snapshot " + str(previous[0]) + " (" + datetime.fromtimestamp(previous[1]).strftime("%Y-%m-%d %H:%M") + ")\033[0m\n")
+        if rows:
+            print_rows(header, rows, args.format)
+
+# answered from the latest snapshot with the board_state_fw index, no api calls
+def query_fw(args):
+    target = BOARD_TYPES_BY_KEY.get(catalog_key(args.query_fw[0]))
+    if target is None:
+        print("Error: unknown target '" + args.query_fw[0] + "' (use " + ", ".join(BOARD_TYPES_BY_KEY) + ")")
+        sys.exit(1)
+    if not os.path.exists(args.snapshot_db):
+        print("Error: no snapshots in " + args.snapshot_db + " yet, run --snapshot first")
+        sys.exit(1)
+    db = open_snapshot_db(args.snapshot_db)
+    if len(args.query_fw) == 1:
+        header = ["Version", "Boards", "Machines"]
+        rows = [[format_version((major, minor, patch), notes), str(boards), str(machines)]
+                for major, minor, patch, notes, boards, machines in db.execute(
+                    "SELECT fw_major, fw_minor, fw_patch, fw_notes, COUNT(*), COUNT(DISTINCT machine_id) FROM board_state "
+                    "WHERE valid_to IS NULL AND board_type = ? GROUP BY fw_major, fw_minor, fw_patch, fw_notes "
+                    "ORDER BY fw_major, fw_minor, fw_patch", (target.name,))]
+    else:
+        parts = args.query_fw[1].lower().replace(".x", "").split(".")
+        if not 1 <= len(parts) <= 3 or not all(part.isdigit() for part in parts):
+            print("Error: version '" + args.query_fw[1] + "' should look like 1, 1.4, 1.4.x or 1.4.2")
+            sys.exit(1)
+        conditions = " AND ".join(column + " = ?" for column in ["fw_major", "fw_minor", "fw_patch"][:len(parts)])
+        header = ["Machine", "ID", "Board", "Current FW", "Status", "Queued FW"]
+        rows = [[name or "Machine " + str(machine_id), str(machine_id), label,
+                 format_version((major, minor, patch), notes), status, scheduled]
+                for machine_id, name, label, major, minor, patch, notes, status, scheduled in db.execute(
+                    "SELECT b.machine_id, m.name, b.label, b.fw_major, b.fw_minor, b.fw_patch, b.fw_notes, b.status, b.scheduled_fw "
+                    "FROM board_state b LEFT JOIN machine_state m ON m.machine_id = b.machine_id AND m.valid_to IS NULL "
+                    "WHERE b.valid_to IS NULL AND b.board_type = ? AND " + conditions + " ORDER BY m.name, b.label",
+                    [target.name] + [int(part) for part in parts])]
+    db.close()
+    if args.format == "table":
+        print()
+    print_rows(header, rows, args.format)
+
 def graph_temps(args):
-    print("\nGraphing recent temperatures for Machine ID " + str(args.graph_temps) + "...")
-    headers = {'Authorization' : str(authtoken), 'x-api-key': str(apikey)}
-    payload = {}
-    url = "https://api.backbar.com/log?machineId="
-    url += str(args.graph_temps)
-    url += "&count=50"
-    response = requests.request("GET", url, headers=headers, data=payload)
-    logfiles = json.loads(response.text)
+    if args.plot_dir is not None or len(args.graph_temps) != 1:
+        graph_temps_batch(args)
+        return
+    machine_id = args.graph_temps[0]
+    print("\nGraphing recent temperatures for Machine ID " + str(machine_id) + "...")
+    logfiles = api.get_logs(machine_id, 50)
 
     menu_title = "~ ~ select temperature file you want to graph and download (press 'q' to quit) ~ ~\n"
     menu_items = []
@@ -269,101 +1361,603 @@ def graph_temps(args):
     )
 
     menu_entry_index = terminal_menu.show()
-    if menu_entry_index is not None and menu_entry_index < len(logfiles['data']):
-        selected_log = temp_logs[menu_entry_index]
-        log = requests.request("GET", selected_log['fileUrl'])
-
-    log = requests.request("GET", selected_log['fileUrl'])
-    write_file(selected_log['fileName'], log.text)
+    if menu_entry_index is None or menu_entry_index >= len(temp_logs):
+        print("No option selected, quitting...\n")
+        return
+    selected_log = temp_logs[menu_entry_index]
+    download_log(selected_log)
     print("\n*** Full temp log saved to " + selected_log['fileName'] + " ***\n")
     print("Graphing temperature data...\n")
-    plot_csv_data(selected_log['fileName'], args.graph_temps, selected_log['addDT'])
+    plot_csv_data(selected_log['fileName'], machine_id, selected_log['addDT'])
+
+# headless: newest temperature logs of every machine are downloaded and rendered to files, no menus or tk
+def graph_temps_batch(args):
+    machine_ids = select_machine_ids(args.graph_temps, args)
+    plot_dir = args.plot_dir or TEMP_PLOT_DIR
+    os.makedirs(plot_dir, exist_ok=True)
+    print("\nRendering latest temperature logs for " + str(len(machine_ids)) + " machine(s) into " + plot_dir + "...\n")
+    downloads = download_latest_temp_logs(machine_ids, args.latest_temps, plot_dir)
+    jobs = []
+    for log, name in zip(downloads, temp_log_names([log['fileName'] for log in downloads])):
+        title = 'Refrigerator Performance, Machine ID: ' + str(log['machineId']) + ", Date: " + str(log['addDT'])
+        jobs.append((log['fileName'], plot_output_path(name, plot_dir, args.plot_format), title, args.plot_width))
+    render_temp_plots([job for job in jobs if os.path.exists(job[0])])
+
+# the newest TEMPERATURE logs of every machine, downloaded into directory as MACHINE_ID_FILENAME,
+# returns the logs with fileName pointing at the local copy and machineId set
+def download_latest_temp_logs(machine_ids, latest, directory):
+    def list_temp_logs(machine_id):
+        try:
+            logfiles = api.get_logs(machine_id, 50)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print("!!! Failed to list logs for Machine ID " + str(machine_id) + ": " + str(e))
+            return []
+        return [log for log in logfiles['data'] if "TEMPERATURE" in log['fileName']][:latest]
+
+    downloads = []
+    for machine_id, temp_logs in zip(machine_ids, engine.map(list_temp_logs, machine_ids)):
+        for log in temp_logs:
+            downloads.append(dict(log, fileName=os.path.join(directory, str(machine_id) + "_" + os.path.basename(log['fileName'])), machineId=machine_id))
+    download_logs(downloads)
+    return downloads
+
+def render_temps(args):
+    plot_dir = args.plot_dir or TEMP_PLOT_DIR
+    os.makedirs(plot_dir, exist_ok=True)
+    jobs = [(file_path, plot_output_path(name, plot_dir, args.plot_format), name, args.plot_width)
+            for file_path, name in zip(args.render_temps, temp_log_names(args.render_temps))]
+    render_temp_plots(jobs)
+
+# output name per temperature log: its path below the deepest directory all the logs share with "/" turned
+# into "_" and only .gz / .csv dropped, so archive/MACHINE/DAY/NAME.csv.gz of different machines don't collide
+def temp_log_names(file_paths):
+    paths = [os.path.abspath(file_path) for file_path in file_paths]
+    if not paths:
+        return []
+    root = os.path.commonpath([os.path.dirname(path) for path in paths])
+    names = []
+    for path in paths:
+        name = os.path.relpath(path, root)
+        for suffix in (".gz", ".csv"):
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+        names.append(name.replace(os.sep, "_"))
+    return names
+
+def plot_output_path(name, plot_dir, plot_format):
+    return os.path.join(plot_dir, name + "." + plot_format)
+
+# parsing + drawing is cpu bound so charts are rendered in a process pool
+def render_temp_plots(jobs):
+    start = time.time()
+    rendered = 0
+    out_paths = {}
+    for job in jobs:
+        if job[1] in out_paths:
+            print("!!! Skipping " + job[0] + ", " + out_paths[job[1]][0] + " is already rendered to " + job[1])
+        else:
+            out_paths[job[1]] = job
+    jobs = list(out_paths.values())
+    with profiler.phase("plot (process pool)"), ProcessPoolExecutor() as pool:
+        futures = {pool.submit(render_temp_plot, *job): job for job in jobs}
+        for future in as_completed(futures):
+            file_path, out_path = futures[future][:2]
+            try:
+                future.result()
+            except Exception as e:
+                print("!!! Failed to render " + file_path + ": " + str(e))
+                continue
+            rendered += 1
+            print("*** Chart saved to " + out_path + " ***")
+    print("\nRendered " + str(rendered) + " of " + str(len(jobs)) + " chart(s) in " + str(round(time.time() - start, 2)) + "s\n")
+
+# temperature logs are sometimes written without a row delimiter before the next timestamp,
+# this wraps the raw file and starts a new line at every timestamp (any year) as it is read
+class TempLogStream:
+    def __init__(self, f):
+        self.f = f
+        self.carry = b""
+        self.eof = False
+
+    def read(self, size=-1):
+        while not self.eof:
+            chunk = self.f.read(TEMP_READ_SIZE)
+            if not chunk:
+                self.eof = True
+                text, self.carry = self.carry, b""
+            else:
+                buffer = self.carry + chunk
+                cut = max(buffer.rfind(b","), buffer.rfind(b"\n"))
+                if cut <= 0:
+                    self.carry = buffer
+                    continue
+                text, self.carry = buffer[:cut], buffer[cut:]
+            if text:
+                return repair_temp_rows(text)
+        return b""
+
+# vectorised search for "YYYY-MM-DD[ T]" that isn't at the start of a line, a newline is inserted before each
+def repair_temp_rows(text):
+    import numpy as np
+    raw = np.frombuffer(text, dtype=np.uint8)
+    if len(raw) < 11:
+        return text
+    starts = np.flatnonzero(raw[4:len(raw) - 6] == ord("-"))
+    starts = starts[(raw[starts + 7] == ord("-")) & ((raw[starts + 10] == ord(" ")) | (raw[starts + 10] == ord("T")))]
+    for offset in range(4):
+        digits = raw[starts + offset]
+        starts = starts[(digits >= ord("0")) & (digits <= ord("9"))]
+    starts = starts[starts > 0]
+    starts = starts[raw[starts - 1] != ord("\n")]
+    if len(starts) == 0:
+        return text
+    return np.insert(raw, starts, ord("\n")).tobytes()
+
+def parse_temp_log(file_path):
+    import pandas as pd
+    opener = gzip.open if file_path.endswith(".gz") else open
+    with profiler.phase("csv parse"), opener(file_path, "rb") as f:
+        data = pd.read_csv(TempLogStream(f),
+                           usecols=["Timestamp"] + TEMP_COLUMNS,
+                           index_col=False,
+                           dtype={column: "float32" for column in TEMP_COLUMNS})
+    data['Timestamp'] = pd.to_datetime(data['Timestamp'], format="ISO8601")
+    data.set_index('Timestamp', inplace=True)
+    return data
+
+# all stats are computed headless with numpy/scipy, nothing here touches matplotlib or tk
+def analyze_temp_data(data, threshold):
+    import numpy as np
+    from scipy.fft import rfft, rfftfreq
+    data = data[~data.index.duplicated()].sort_index()
+    cabinet = data[TEMP_CABINET_COLUMNS].max(axis=1).to_numpy(dtype=np.float64)
+    seconds = (data.index - data.index[0]).total_seconds().to_numpy() if len(data) else np.array([])
+    dt = np.minimum(np.diff(seconds), TEMP_MAX_GAP_SECONDS)
+
+    above = cabinet > threshold
+    seconds_above = float(dt[above[:-1]].sum()) if len(dt) else 0.0
+    excursions = find_temp_excursions(data.index, cabinet, above, seconds)
+
+    # uniform 1 minute grid for duty cycle and fft
+    uniform = data[TEMP_CABINET_COLUMNS].mean(axis=1).resample(TEMP_RESAMPLE).mean().interpolate(limit=10)
+    smoothed = uniform.rolling(5, min_periods=1, center=True).mean().to_numpy()
+    slope = np.diff(smoothed)
+    slope = slope[~np.isnan(slope)]
+    duty_cycle = float((slope < 0).mean()) if len(slope) else None
+
+    period_minutes = None
+    signal = uniform.to_numpy()
+    signal = signal[~np.isnan(signal)]
+    if len(signal) >= 2 * TEMP_MAX_CYCLE_MINUTES:
+        spectrum = np.abs(rfft((signal - signal.mean()) * np.hanning(len(signal))))
+        freqs = rfftfreq(len(signal), d=1.0)
+        band = (freqs >= 1.0 / TEMP_MAX_CYCLE_MINUTES) & (freqs <= 1.0 / TEMP_MIN_CYCLE_MINUTES)
+        if band.any():
+            period_minutes = float(1.0 / freqs[band][np.argmax(spectrum[band])])
+
+    rolling = uniform.to_frame("Cabinet Temp").join(data[TEMP_COLUMNS].resample(TEMP_RESAMPLE).mean())
+    rolling = rolling.rolling(TEMP_ROLLING_WINDOW, min_periods=1).agg(["min", "max", "mean"])
+    rolling.columns = [column + " " + stat for column, stat in rolling.columns]
+
+    total_seconds = float(dt.sum()) if len(dt) else 0.0
+    summary = {
+        "start"                  : str(data.index[0]) if len(data) else None,
+        "end"                    : str(data.index[-1]) if len(data) else None,
+        "samples"                : int(len(data)),
+        "hours"                  : round(total_seconds / 3600, 2),
+        "threshold"              : threshold,
+        "seconds_above"          : round(seconds_above),
+        "percent_above"          : round(100 * seconds_above / total_seconds, 2) if total_seconds else 0.0,
+        "duty_cycle"             : round(duty_cycle, 3) if duty_cycle is not None else None,
+        "cycle_period_minutes"   : round(period_minutes, 1) if period_minutes is not None else None,
+        "excursions"             : len(excursions),
+        "longest_excursion_min"  : max((event["minutes"] for event in excursions), default=0),
+        "worst_temp"             : round(float(np.nanmax(cabinet)), 1) if len(cabinet) else None
+    }
+    for column in TEMP_COLUMNS:
+        values = data[column].to_numpy(dtype=np.float64)
+        summary[column + " min"] = round(float(np.nanmin(values)), 1) if len(values) else None
+        summary[column + " mean"] = round(float(np.nanmean(values)), 1) if len(values) else None
+        summary[column + " max"] = round(float(np.nanmax(values)), 1) if len(values) else None
+    return summary, rolling.iloc[::60], excursions
 
-def sanitize_temp_data(file_path):
-    with open(file_path, 'r') as f:
-        data = f.read()
-        cleaned_data = re.sub(r'(?<!\,)2024', r',2024', data)
-    with open(file_path, 'w') as f:
-        f.write(cleaned_data)
+# runs of consecutive samples above the threshold, shorter blips (door openings) are dropped
+def find_temp_excursions(index, cabinet, above, seconds):
+    import numpy as np
+    edges = np.diff(np.concatenate(([0], above.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    excursions = []
+    for start, end in zip(starts, ends):
+        duration = seconds[end] - seconds[start]
+        if duration < TEMP_MIN_EXCURSION_SECONDS:
+            continue
+        excursions.append({
+            "start"   : str(index[start]),
+            "end"     : str(index[end]),
+            "minutes" : round(duration / 60, 1),
+            "peak"    : round(float(cabinet[start:end + 1].max()), 1)
+        })
+    return excursions
+
+def analyze_temps(args):
+    summaries = []
+    names = {}
+    for file_path, name in zip(args.analyze_temps, temp_log_names(args.analyze_temps)):
+        try:
+            summary, rolling, excursions = analyze_temp_data(parse_temp_log(file_path), args.temp_threshold)
+        except (OSError, ValueError) as e:
+            print("!!! Failed to analyze " + file_path + ": " + str(e))
+            continue
+        summary = {"file": file_path, **summary}
+        summaries.append(summary)
+        names[file_path] = name
+        if args.analysis_dir:
+            os.makedirs(args.analysis_dir, exist_ok=True)
+            base = os.path.join(args.analysis_dir, name)
+            write_file(base + ".summary.json", json.dumps({**summary, "excursion_events": excursions}, indent=2))
+            rolling.to_csv(base + ".rolling.csv", float_format="%.2f")
+            with open(base + ".excursions.csv", "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=["start", "end", "minutes", "peak"])
+                writer.writeheader()
+                writer.writerows(excursions)
+
+    if not summaries:
+        return
+    if args.format != "table":
+        print_rows(list(summaries[0]), [list(summary.values()) for summary in summaries], args.format)
+    else:
+        header = ["File", "Hours", "% Above " + str(args.temp_threshold), "Duty Cycle", "Cycle (min)", "Excursions", "Longest (min)", "Worst Temp"]
+        rows = [[names[summary["file"]], summary["hours"], summary["percent_above"], summary["duty_cycle"],
+                 summary["cycle_period_minutes"], summary["excursions"], summary["longest_excursion_min"], summary["worst_temp"]]
+                for summary in summaries]
+        print()
+        print_rows(header, rows, args.format)
+
+def summarize_temp_file(file_path, threshold):
+    import numpy as np
+    data = parse_temp_log(file_path)
+    summary, rolling, excursions = analyze_temp_data(data, threshold)
+    cabinet = data[TEMP_CABINET_COLUMNS].max(axis=1).to_numpy(dtype=np.float64)
+    histogram = np.histogram(cabinet[~np.isnan(cabinet)], bins=TEMP_HISTOGRAM_BINS)[0]
+    return summary, histogram
+
+# percentiles of a merged histogram, each value is the upper edge of the bin the percentile falls in
+def histogram_percentiles(histogram, percentiles):
+    import numpy as np
+    total = histogram.sum()
+    if total == 0:
+        return [None for p in percentiles]
+    cumulative = np.cumsum(histogram)
+    return [round(float(TEMP_HISTOGRAM_BINS[np.searchsorted(cumulative, total * p / 100) + 1]), 1) for p in percentiles]
+
+def reduce_temp_summaries(summaries, histograms):
+    import numpy as np
+    histogram = np.sum(histograms, axis=0)
+    hours = sum(summary["hours"] for summary in summaries)
+    seconds_above = sum(summary["seconds_above"] for summary in summaries)
+    duty_cycles = [(summary["duty_cycle"], summary["hours"]) for summary in summaries if summary["duty_cycle"] is not None]
+    periods = [summary["cycle_period_minutes"] for summary in summaries if summary["cycle_period_minutes"] is not None]
+    p50, p95, p99 = histogram_percentiles(histogram, [50, 95, 99])
+    reduced = {
+        "files"                 : sum(summary.get("files", 1) for summary in summaries),
+        "samples"               : sum(summary["samples"] for summary in summaries),
+        "hours"                 : round(hours, 2),
+        "seconds_above"         : seconds_above,
+        "percent_above"         : round(100 * seconds_above / (hours * 3600), 2) if hours else 0.0,
+        "duty_cycle"            : round(sum(d * h for d, h in duty_cycles) / max(sum(h for d, h in duty_cycles), 1e-9), 3) if duty_cycles else None,
+        "cycle_period_minutes"  : round(float(np.median(periods)), 1) if periods else None,
+        "excursions"            : sum(summary["excursions"] for summary in summaries),
+        "longest_excursion_min" : max(summary["longest_excursion_min"] for summary in summaries),
+        "worst_temp"            : max((summary["worst_temp"] for summary in summaries if summary["worst_temp"] is not None), default=None),
+        "p50"                   : p50,
+        "p95"                   : p95,
+        "p99"                   : p99
+    }
+    return reduced, histogram
+
+def write_columnar(rows, path):
+    import pandas as pd
+    frame = pd.DataFrame(rows)
+    try:
+        frame.to_parquet(path + ".parquet", index=False)
+        return path + ".parquet"
+    except ImportError:
+        print("!!! pyarrow is not installed (run python install.py), writing csv instead")
+        frame.to_csv(path + ".csv", index=False)
+        return path + ".csv"
+
+# map: newest temperature logs of every machine are parsed in a process pool
+# reduce: per machine and fleet wide stats, percentiles come from merged histograms
+def fleet_temps(args):
+    machine_ids = select_machine_ids(args.fleet_temps, args)
+    machine_index = get_machine_index()
+    raw_dir = os.path.join(args.fleet_dir, "raw")
+    os.makedirs(raw_dir, exist_ok=True)
+    print("\nCollecting temperature logs for " + str(len(machine_ids)) + " machine(s)...\n")
+    downloads = download_latest_temp_logs(machine_ids, args.latest_temps, raw_dir)
+
+    print("Parsing " + str(len(downloads)) + " temperature log(s)...\n")
+    start = time.time()
+    per_machine = {}
+    file_rows = []
+    with profiler.phase("csv parse + analysis (process pool)"), ProcessPoolExecutor() as pool:
+        futures = {pool.submit(summarize_temp_file, log['fileName'], args.temp_threshold): log
+                   for log in downloads if os.path.exists(log['fileName'])}
+        for future in as_completed(futures):
+            log = futures[future]
+            try:
+                summary, histogram = future.result()
+            except Exception as e:
+                print("!!! Failed to parse " + log['fileName'] + ": " + str(e))
+                continue
+            per_machine.setdefault(log['machineId'], []).append((summary, histogram))
+            file_rows.append({"machine_id": log['machineId'], "file": log['fileName'], "addDT": log['addDT'], **summary})
+    if not per_machine:
+        print("No temperature logs to summarize\n")
+        return
+
+    machine_rows = []
+    machine_histograms = []
+    for machine_id, results in per_machine.items():
+        reduced, histogram = reduce_temp_summaries([r[0] for r in results], [r[1] for r in results])
+        machine = machine_index.get(machine_id)
+        machine_rows.append({"machine_id": machine_id, "machine": machine.name if machine else "Machine " + str(machine_id), **reduced})
+        machine_histograms.append(histogram)
+    fleet, fleet_histogram = reduce_temp_summaries(machine_rows, machine_histograms)
+    fleet["machines"] = len(machine_rows)
+    fleet["threshold"] = args.temp_threshold
+    machine_rows.sort(key=lambda row: (row["percent_above"], row["worst_temp"] or 0), reverse=True)
+    fleet["worst_offenders"] = [row["machine"] for row in machine_rows[:TEMP_WORST_OFFENDERS]]
+
+    machines_path = write_columnar(machine_rows, os.path.join(args.fleet_dir, "machines"))
+    files_path = write_columnar(file_rows, os.path.join(args.fleet_dir, "files"))
+    write_file(os.path.join(args.fleet_dir, "fleet.json"), json.dumps(fleet, indent=2))
+
+    header = ["Machine", "ID", "Hours", "% Above " + str(args.temp_threshold), "p50", "p95", "p99", "Excursions", "Worst Temp"]
+    rows = [[row["machine"], row["machine_id"], row["hours"], row["percent_above"], row["p50"], row["p95"], row["p99"], row["excursions"], row["worst_temp"]]
+            for row in machine_rows[:TEMP_WORST_OFFENDERS]]
+    print("\033[1mWorst offenders:\033[0m\n")
+    print(render_table([header] + [[str(item) for item in row] for row in rows]))
+    print("Fleet: " + str(fleet["machines"]) + " machine(s), " + str(fleet["hours"]) + " hours, " + str(fleet["percent_above"]) +
+          "% above " + str(args.temp_threshold) + "F, p50/p95/p99 " + str(fleet["p50"]) + "/" + str(fleet["p95"]) + "/" + str(fleet["p99"]) +
+          "F, parsed in " + str(round(time.time() - start, 2)) + "s\n")
+    print("*** Summaries saved to " + machines_path + ", " + files_path + " and " + os.path.join(args.fleet_dir, "fleet.json") + " ***\n")
+
+# plotting deps take seconds to import so they are only loaded by the commands that graph
+def import_plotting_modules():
+    import pandas as pd
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
+    import tkinter as tk
+    return pd, plt, mdates, tk
+
+# keeps the min and max of every pixel wide bucket, so spikes survive but points drawn ~= 2 * width
+def decimate_min_max(data, columns, buckets):
+    import numpy as np
+    if len(data) <= 2 * buckets:
+        return data.index, {column: data[column].to_numpy() for column in columns}
+    seconds = (data.index - data.index[0]).total_seconds().to_numpy()
+    edges = np.linspace(seconds[0], seconds[-1], buckets + 1)[:-1]
+    starts = np.unique(np.searchsorted(seconds, edges, side="left"))
+    times = np.repeat(data.index[starts].to_numpy(), 2)
+    decimated = {}
+    for column in columns:
+        values = data[column].to_numpy()
+        decimated[column] = np.column_stack([np.fmin.reduceat(values, starts), np.fmax.reduceat(values, starts)]).ravel()
+    return times, decimated
+
+def draw_temp_figure(fig, data, title, buckets):
+    import matplotlib.dates as mdates
+    times, values = decimate_min_max(data, TEMP_COLUMNS, buckets)
+    ax = fig.add_subplot(1, 1, 1)
+    ax.plot(times, values['In 1 Temp'], label='Upper Temperature')
+    ax.plot(times, values['In 2 Temp'], label='Lower Temperature')
+    ax.plot(times, values['Out Temp'], label='Outside Temperature')
+    ax.set_xlabel('Timestamp')
+    ax.set_ylabel('Temperature (F)')
+    ax.set_title(title)
+    ax.set_ylim(10, 100)
+    if len(data) and data.index[-1] - data.index[0] <= TEMP_PLOT_HOURLY_SPAN:
+        ax.xaxis.set_major_locator(mdates.HourLocator(interval=4))
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M:%S'))
+        ax.xaxis.set_minor_locator(mdates.HourLocator(interval=1))
+    else:
+        # multi-day logs would get thousands of hourly ticks
+        locator = mdates.AutoDateLocator()
+        ax.xaxis.set_major_locator(locator)
+        ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+    ax.grid(which='major', linestyle='-', linewidth='0.5', color='gray')
+    ax.minorticks_on()
+    ax.grid(which='minor', linestyle=':', linewidth='0.5', color='gray')
+    ax.legend()
+
+# runs in a worker process, uses the Agg canvas directly so no display or tk is needed
+def render_temp_plot(file_path, out_path, title, width):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    data = parse_temp_log(file_path)
+    fig = Figure(figsize=(width / TEMP_PLOT_DPI, width / TEMP_PLOT_DPI / 2), dpi=TEMP_PLOT_DPI)
+    FigureCanvasAgg(fig)
+    draw_temp_figure(fig, data, title, width)
+    fig.savefig(out_path)
+    return out_path
 
 def plot_csv_data(file_path, id, date):
+    pd, plt, mdates, tk = import_plotting_modules()
     root = tk.Tk()
     root.withdraw()
-    sanitize_temp_data(file_path)
     try:
-        data = pd.read_csv(file_path)
-        data['Timestamp'] = pd.to_datetime(data['Timestamp'])
-        data.set_index('Timestamp', inplace=True)
-
-        plt.figure(figsize=(14, 7))
-        plt.plot(data.index, data['In 1 Temp'], label='Upper Temperature')
-        plt.plot(data.index, data['In 2 Temp'], label='Lower Temperature')
-        plt.plot(data.index, data['Out Temp'], label='Outside Temperature')
-        plt.xlabel('Timestamp')
-        plt.ylabel('Temperature (F)')
-        plt.title('Refrigerator Performance, Machine ID: ' + str(id) + ", Date: " + date)
-        plt.ylim(10, 100)
-        plt.gca().xaxis.set_major_locator(mdates.HourLocator(interval=4))
-        plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%H:%M:%S'))
-        plt.gca().xaxis.set_minor_locator(mdates.HourLocator(interval=1))
-        plt.grid(which='major', linestyle='-', linewidth='0.5', color='gray')
-        plt.minorticks_on()
-        plt.grid(which='minor', linestyle=':', linewidth='0.5', color='gray')
-        plt.legend()
+        data = parse_temp_log(file_path)
+        fig = plt.figure(figsize=(14, 7))
+        # extra resolution so zooming in the interactive window still shows detail
+        draw_temp_figure(fig, data, 'Refrigerator Performance, Machine ID: ' + str(id) + ", Date: " + date, TEMP_PLOT_WIDTH * 4)
         plt.show()
 
-    except pd.errors.ParserError:
+    except (pd.errors.ParserError, ValueError):
         print("Error: Failed to parse the CSV file.")
         sys.exit(1)
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
         sys.exit(1)
 
+# fuzzy score of one query term against an entry's search text, lower is better, None if it doesn't match
+# exact substrings win (at a word start over mid-word), then letters in order with the fewest gaps
+def fuzzy_score(key, term):
+    start = key.find(term)
+    if start >= 0:
+        return 0 if start == 0 or not key[start - 1].isalnum() else 1
+    gaps = 0
+    position = -1
+    for char in term:
+        found = key.find(char, position + 1)
+        if found < 0:
+            return None
+        if position >= 0:
+            gaps += found - position - 1
+        position = found
+    return 2 + gaps
+
+# search text of every menu entry lowercased once, results cached per query
+# a query that extends an earlier one only rescans the earlier matches, so typing more gets cheaper
+# terms are ANDed, 80-120 style terms match entry IDs when ids are given
+class MenuSearch:
+    def __init__(self, keys, ids=None):
+        self.keys = [key.lower() for key in keys]
+        self.ids = ids
+        self.matches = {"": list(range(len(keys)))}
+
+    def match(self, query):
+        terms = query.lower().split()
+        id_ranges = []
+        text_terms = []
+        for term in terms:
+            id_range = re.fullmatch(r"(\d+)-(\d+)", term) if self.ids is not None else None
+            if id_range:
+                id_ranges.append((int(id_range.group(1)), int(id_range.group(2))))
+            else:
+                text_terms.append(term)
+        text = " ".join(text_terms)
+        if text not in self.matches:
+            narrowest = max((cached for cached in self.matches if text.startswith(cached)), key=len)
+            scored = []
+            for position in self.matches[narrowest]:
+                scores = [fuzzy_score(self.keys[position], term) for term in text_terms]
+                if None not in scores:
+                    scored.append((sum(scores), position))
+            self.matches[text] = [position for score, position in sorted(scored)]
+        matches = self.matches[text]
+        if id_ranges:
+            matches = [position for position in matches if any(low <= self.ids[position] <= high for low, high in id_ranges)]
+        return matches
+
+# pages of MENU_PAGE_SIZE entries so a big list never goes into one TerminalMenu, plus shortcut rows to search,
+# change page and (multi select) select everything matching the search. selections are kept across pages and searches
+# returns ("done", positions) for multi select, ("done", position) for single select, (name, None) for an extra entry
+# or None when the menu was quit
+def select_from_menu(title, labels, search, search_hint, multi_select=False, extra_entries=()):
+    query = ""
+    page = 0
+    selected = set()
+    while True:
+        matches = search.match(query)
+        pages = max(1, -(-len(matches) // MENU_PAGE_SIZE))
+        page = min(page, pages - 1)
+        shown = matches[page * MENU_PAGE_SIZE:(page + 1) * MENU_PAGE_SIZE]
+        search_label = "'" + query + "' - " if query else ""
+        actions = [("search", "[/] search (" + search_label + str(len(matches)) + " of " + str(len(labels)) + " shown)")]
+        if page + 1 < pages:
+            actions.append(("next", "[n] next page"))
+        if page > 0:
+            actions.append(("previous", "[p] previous page"))
+        if multi_select:
+            actions.append(("all", "[a] select all " + str(len(matches)) + " matching"))
+            if selected:
+                actions.append(("clear", "[x] clear selection"))
+            actions.append(("done", "[d] done (" + str(len(selected)) + " selected)"))
+        actions.extend(extra_entries)
+        status = "page " + str(page + 1) + "/" + str(pages)
+        if multi_select:
+            status += ", " + str(len(selected)) + " selected"
+
+        terminal_menu = TerminalMenu(
+            menu_entries=[labels[position] for position in shown] + [label for name, label in actions],
+            title = title + status + "\n",
+            clear_screen = True,
+            cycle_cursor = True,
+            multi_select = multi_select,
+            preselected_entries = [index for index, position in enumerate(shown) if position in selected] or None
+        )
+        with profiler.phase("user input"):
+            chosen = terminal_menu.show()
+        if chosen is None:
+            return None
+        chosen = chosen if multi_select else (chosen,)
+        action = next((actions[index - len(shown)][0] for index in chosen if index >= len(shown)), "done")
+        if multi_select:
+            selected = (selected - set(shown)) | {shown[index] for index in chosen if index < len(shown)}
+
+        if action == "search":
+            with profiler.phase("user input"):
+                query = input("search " + search_hint + ", blank shows all: ").strip()
+            page = 0
+        elif action == "next":
+            page += 1
+        elif action == "previous":
+            page -= 1
+        elif action == "all":
+            selected |= set(matches)
+        elif action == "clear":
+            selected = set()
+        elif action == "done":
+            if not multi_select:
+                return "done", shown[chosen[0]]
+            if selected:
+                return "done", sorted(selected)
+        else:
+            return action, None
+
 def present_list_of_machines(machines):
     menu_title = "~ select machine(s) to update (press 'space' to select, 'enter' to confirm) ~ ~\n"
     raw_menu_options = []
     for machine in machines:
         option = {
-            "name"   : machine['name'],
-            "id"     : str(machine['id']),
-            "serial" : str(machine['serialNumber'])
+            "name"   : machine.name,
+            "id"     : str(machine.id),
+            "serial" : machine.serial
         }
         raw_menu_options.append(option)
-    max_length = max(len(option["name"]) for option in raw_menu_options)
-    max_length_id = max(len(option["id"]) for option in raw_menu_options)
+    max_length = max((len(option["name"]) for option in raw_menu_options), default=0)
+    max_length_id = max((len(option["id"]) for option in raw_menu_options), default=0)
     menu_options = [
         option['name'].ljust(max_length) + "  -   ID: " + option['id'].ljust(max_length_id) + "   Serial #: " + option['serial']
         for option in raw_menu_options
     ]
-    menu_options.append("*** QUIT (quit application and return to terminal)")
-
-    terminal_menu = TerminalMenu(
-        menu_entries=menu_options,
-        title = menu_title,
-        clear_screen = True,
-        cycle_cursor = True,
-        multi_select=True
-    )
+    search = MenuSearch([
+        machine.name + " " + str(machine.id) + " " + machine.serial + " " + machine.org
+        for machine in machines
+    ], ids=[machine.id for machine in machines])
 
-    selected_options = terminal_menu.show()
-    selected_machines = []
+    selection = select_from_menu(menu_title, menu_options, search, "(name, ID, serial, org, 80-120 for an ID range)", multi_select=True,
+                                 extra_entries=[("quit", "*** QUIT (quit application and return to terminal)")])
 
-    if selected_options is not None:
-        if len(menu_options) - 1 in selected_options:
+    if selection is not None:
+        action, selected_options = selection
+        if action == "quit":
             sys.exit()
-        selected_machines = [machines[index] for index in selected_options if menu_options[index].strip()]
+        selected_machines = [machines[index] for index in selected_options]
         print("\033[1mSelected machines:\033[0m\n")
         for machine in selected_machines:
-            print("* " + machine['name'])
+            print("* " + machine.name)
         print("\n")
-        time.sleep(0.5)
+        ui_pause(0.5)
         for i in range(7):
             print_at_bottom("\033[1m!!!!!! REVIEW LIST CAREFULLY !!!!!!!\033[0m")
-            time.sleep(0.3)
+            ui_pause(0.3)
             print_at_bottom("")
-            time.sleep(0.2)
+            ui_pause(0.2)
         print_at_bottom("\033[1m!!!!!! REVIEW LIST CAREFULLY !!!!!!!\033[0m")
-        time.sleep(0.5)
+        ui_pause(0.5)
         wait_for_specific_input("yes")
         print("\nMachines confirmed, continuing to firmware application selections...\n")
         return selected_machines
@@ -371,42 +1965,41 @@ def present_list_of_machines(machines):
         print("No option selected, quitting...\n")
         quit()
 
-def present_list_of_apps(list_of_apps):
-    target = list_of_apps[0]['type']['name']
+# newest first, every version of the target is reachable through paging and search
+def present_list_of_apps(catalog, target, notes_filter):
+    list_of_apps = catalog.get(target, notes_filter)[::-1]
     menu_title = "~ select " + target.upper() + " firmware version to queue ~ ~\n"
     raw_menu_options = []
     for app in list_of_apps:
-        if app['notes'] is not None and app['notes'] != "" and len(app['notes']) > 2:
-            notes = "-" + app['notes']
+        if app.notes is not None and app.notes != "" and len(app.notes) > 2:
+            notes = "-" + app.notes
         else:
             notes = " !!!! PROD RELEASE - no notes !!!!"
         option = {
             "target" : target,
-            "version": str(app['fwMajor']) + "." + str(app['fwMinor']) + "." + str(app['fwPatch']),
+            "version": app.version_str,
             "notes"  : notes
         }
         raw_menu_options.append(option)
-    max_length = max(len(option["version"]) for option in raw_menu_options)
+    max_length = max((len(option["version"]) for option in raw_menu_options), default=0)
     menu_options = [
         option['target'] + "  -  " + option['version'].ljust(max_length) + option['notes']
         for option in raw_menu_options
     ]
-    menu_options.append("*--- NONE ---* (do not update firmware for this target)")
-    menu_options.append("**** QUIT **** (quit and return to terminal)")
-
-    terminal_menu = TerminalMenu(
-        menu_entries=menu_options,
-        title = menu_title,
-        clear_screen = True,
-        cycle_cursor = True
-    )
+    search = MenuSearch([option['version'] + " " + option['notes'] + (" prod" if "PROD RELEASE" in option['notes'] else "")
+                         for option in raw_menu_options])
+    extra_entries = [
+        ("none", "*--- NONE ---* (do not update firmware for this target)"),
+        ("quit", "**** QUIT **** (quit and return to terminal)")
+    ]
 
     try:
-        selected_option_index = terminal_menu.show()
-        if selected_option_index is not None:
-            if selected_option_index == len(menu_options) - 1:
+        selection = select_from_menu(menu_title, menu_options, search, "(version, notes, prod)", extra_entries=extra_entries)
+        if selection is not None:
+            action, selected_option_index = selection
+            if action == "quit":
                 sys.exit()
-            if selected_option_index == len(menu_options) - 2:
+            if action == "none":
                 selected_app = "None"
                 print("\033[1mSelected application for " + target + ":\033[0m\n")
                 print("  **  No application selected for " + target + "\n")
@@ -414,14 +2007,14 @@ def present_list_of_apps(list_of_apps):
                 selected_app = list_of_apps[selected_option_index]
                 print("\033[1mSelected application for " + target + ":\033[0m\n")
                 print_app_info(selected_app)
-            time.sleep(0.4)
+            ui_pause(0.4)
             for i in range(3):
                 print_at_bottom("\033[1m!!!!!! REVIEW APPLICATION CAREFULLY !!!!!!!\033[0m")
-                time.sleep(0.2)
+                ui_pause(0.2)
                 print_at_bottom("")
-                time.sleep(0.1)
+                ui_pause(0.1)
             print_at_bottom("\033[1m!!!!!! REVIEW APPLICATION CAREFULLY !!!!!!!\033[0m")
-            time.sleep(0.4)
+            ui_pause(0.4)
             wait_for_specific_input("yes")
             print("\nApplication confirmed, continuing...\n")
             return selected_app
@@ -429,28 +2022,24 @@ def present_list_of_apps(list_of_apps):
         sys.exit(0)
 
 def print_app_for_update_confirmation(target, app):
-    if app['notes'] is not None and app['notes'] != "" and len(app['notes']) > 2:
-        notes = "-" + app['notes']
+    if app.notes is not None and app.notes != "" and len(app.notes) > 2:
+        notes = "-" + app.notes
     else:
         notes = " !!!! PROD RELEASE - no notes !!!!"
-    print("* " + target + ": " + str(app['fwMajor'])  
-                        + "." + str(app['fwMinor'])  
-                        + "." + str(app['fwPatch']) 
-                        + notes)
+    print("* " + target + ": " + app.version_str + notes)
 
 def print_all_app_details(all_apps):
     app_list = []
-    for app in all_apps:
+    for app in all_apps.values():
         if app != "None":
-            if app['notes'] is not None and app['notes'] != "" and len(app['notes']) > 2:
-                notes = app['notes']
+            if app.notes is not None and app.notes != "" and len(app.notes) > 2:
+                notes = app.notes
             else:
                 notes = " !!!! PROD RELEASE - no notes !!!!"
-            app_list.append([
-                app['type']['name'],
-                str(app['fwMajor']) + "." + str(app['fwMinor']) + "." + str(app['fwPatch']),
-                notes
-            ])
+            app_list.append([app.target, app.version_str, notes])
+    if not app_list:
+        print("(no applications, queued updates are cleared)")
+        return
     col_widths = [max(len(row[i]) for row in app_list) for i in range(len(app_list[0]))]
     headers = ["Target", "Version", "Notes"]
     header_line = " ".join(headers[i].ljust(col_widths[i] + 3) for i in range(len(headers)))
@@ -461,63 +2050,241 @@ def print_all_app_details(all_apps):
             print(item.ljust(col_widths[i] + 4), end="")
         print()
 
-def convert_app_record(full_board_rec, new_app):
+# PUT body: the board as the api returned it with the new app queued (or the queue cleared)
+def convert_app_record(board, new_app):
+    full_board_rec = dict(board.raw)
     if new_app == "None":
         full_board_rec['scheduled'] = None
         full_board_rec['status'] = "Installed"
         return full_board_rec
     else:
-        new_app["version"] = ""
-        full_board_rec['scheduled'] = new_app
+        full_board_rec['scheduled'] = dict(new_app.raw, version="")
         full_board_rec['status'] = "Pending"
         return full_board_rec
 
-def update_board_records(apps, machines, args, fname):
+# boards are only PUT when the selected app changes what is queued on them, everything else is
+# reported as skipped (already installed / already queued / nothing to clear / not selected)
+def queue_machine_updates(machine, apps):
+    response = api.get_boards(machine.id)
+    if response.status_code != 200:
+        return [board_result(machine, None, "Board list", response.status_code, response.text)]
+    curr_machine_boards = decode_boards(response.content, keep_raw=True)
+    results = []
+    for board in curr_machine_boards:
+        board_type = BOARD_TYPES_BY_NAME.get(board.type_name)
+        if board_type is not None and not board_type.updatable:
+            continue
+        app = apps.get(board.type_name)
+        if board_type is None:
+            change = "unknown board type"
+        else:
+            change = board_plan_change(board, app) if app is not None else "not selected"
+        if change not in ("update", "clear"):
+            queued = format_app_version(board.scheduled) if change == "already queued" else None
+            results.append(board_result(machine, board.id, board.label, None, "", queued, skipped=change))
+            continue
+        response = api.put_board(convert_app_record(board, app))
+        queued = format_app_version(app) if app != "None" else None
+        results.append(board_result(machine, board.id, board.label, response.status_code, response.text, queued))
+    return results
+
+def board_result(machine, board_id, target, status_code, text, queued=None, skipped=None):
+    return {
+        "machine"     : machine.name,
+        "machine_id"  : machine.id,
+        "board_id"    : board_id,
+        "target"      : target,
+        "status_code" : status_code,
+        "text"        : text,
+        "queued"      : queued,
+        "skipped"     : skipped,
+        "ok"          : status_code == 200 or skipped is not None
+    }
+
+def write_machine_results(machine, results, report):
+    print("** Updating boards on " + machine.name)
+    lines = ["** Updating boards on " + machine.name + "\n"]
+    for result in results:
+        report.record("board_result", **result)
+        if result['skipped'] is not None:
+            print("     Skipping target: " + result['target'] + " (" + result['skipped'] + ")\n")
+            lines.append("     Skipping target: " + result['target'] + " (" + result['skipped'] + ")\n\n")
+            continue
+        print("     Deploying application to target: " + result['target'])
+        print("     HTTP response: " + str(result['status_code']) + "\n")
+        lines.append("     Deploying application to target: " + result['target'] +
+                     "\n        HTTP response: " + str(result['status_code']) +
+                     "\n        HTTP text:     " + result['text'] + "\n\n")
+    report.write("".join(lines))
+    report.flush()
+
+# machines are queued concurrently (bounded by --max-workers), boards within a machine stay in order
+def update_board_records(apps, machines, args, report):
+    all_results = queue_board_updates(apps, machines, args, report)
+    write_fleet_status(machines, args, report)
+    write_rollout_summary(all_results, report)
+    return all_results
+
+def write_rollout_summary(all_results, report):
+    failed = [result for result in all_results if not result['ok']]
+    skipped = [result for result in all_results if result['skipped'] is not None]
+    report.record("summary", boards=len(all_results), updated=len(all_results) - len(skipped) - len(failed), skipped=len(skipped), failed=len(failed))
+    sent = [result for result in all_results if result['board_id'] is not None and result['skipped'] is None]
+    summary = str(len(sent)) + " board(s) sent, " + str(len(skipped)) + " skipped (no change needed)\n"
+    print(summary)
+    report.write("\n" + summary)
+    if failed:
+        print("!!! !!! one or more operations failed, check report !!! !!!\n")
+        report.write("!!! !!! one or more operations failed, check report !!! !!!\n")
+
+def queue_board_updates(apps, machines, args, report):
     print("Queuing firmware application updates to all targets on all selected machines...\n")
-    headers = {'Authorization' : str(authtoken), 'x-api-key': str(apikey)}
-    general_boards_url = "https://api.backbar.com/board?machineId="
-    for machine in machines:
-        print("** Updating boards on " + machine['name'])
-        append_file(fname, "** Updating boards on " + machine['name'] + "\n")
-        curr_machine_boards_url = general_boards_url + str(machine['id'])
-        response = requests.request("GET", curr_machine_boards_url, headers=headers)
-        curr_machine_boards = json.loads(response.text)
-        fail = False
-        for board in curr_machine_boards:
-            if board['type']['name'] != "Conveyor" and board['type']['name'] != "Ice Dispenser" and board['type']['name'] is not None:
-                deploy_str = "     Deploying application to target: " + board['type']['name']
-                print(deploy_str)
-                append_file(fname, deploy_str)
-            else:
+    all_results = []
+
+    def write_results(machine, results):
+        if isinstance(results, Exception):
+            results = [board_result(machine, None, "Board list", None, str(results))]
+        write_machine_results(machine, results, report)
+        all_results.extend(results)
+    engine.run(lambda machine: queue_machine_updates(machine, apps), machines, write_results, errors=(requests.exceptions.RequestException,))
+    return all_results
+
+def rollout_waves(machines, canary, wave_percent):
+    waves = [machines[:canary]] if canary > 0 else []
+    wave_size = max(1, -(-len(machines) * wave_percent // 100))
+    for start in range(len(waves[0]) if waves else 0, len(machines), int(wave_size)):
+        waves.append(machines[start:start + int(wave_size)])
+    return [wave for wave in waves if wave]
+
+# polls the wave's machines concurrently until every queued board leaves Pending, the interval
+# backs off while nothing changes and drops back to the minimum as soon as a machine finishes
+# a machine passes when all of its PUTs succeeded and every queued board now runs the queued version
+def wait_for_wave(wave, results, args):
+    expected = {machine.id: {} for machine in wave}
+    outcome = {}
+    for result in results:
+        if not result['ok']:
+            outcome[result['machine_id']] = "PUT failed for " + result['target']
+        elif result['queued'] is not None:
+            expected[result['machine_id']][result['board_id']] = result['queued']
+    pending = [machine_id for machine_id, boards in expected.items() if boards and machine_id not in outcome]
+    interval = POLL_MIN_SECONDS
+    deadline = time.time() + args.poll_timeout
+    while pending and time.time() < deadline:
+        print("     " + str(len(wave) - len(pending)) + "/" + str(len(wave)) + " machine(s) done, polling again in " + str(round(interval)) + "s...")
+        with profiler.phase("canary poll wait"):
+            time.sleep(min(interval, max(deadline - time.time(), 0)))
+        changed = False
+        for machine_id, boards_full_info in zip(pending, fetch_fleet_boards(pending)):
+            if isinstance(boards_full_info, Exception):
+                continue
+            boards = {board.id: board for board in boards_full_info}
+            queued = [(boards[board_id], version) for board_id, version in expected[machine_id].items() if board_id in boards]
+            if any(board.status == "Pending" for board, version in queued):
                 continue
-            if board['type']['name'] == "Main" and updateTargetEnum.Main.value < len(apps) - 1:
-                board = convert_app_record(board, apps[updateTargetEnum.Main.value])
-            if board['type']['name'] == "Solenoid" and updateTargetEnum.Solenoid.value < len(apps) - 1:
-                board = convert_app_record(board, apps[updateTargetEnum.Solenoid.value])
-            if board['type']['name'] == "Pump" and updateTargetEnum.Pump.value < len(apps) - 1:
-                board = convert_app_record(board, apps[updateTargetEnum.Pump.value])
-            if board['type']['name'] == "Nozzle" and updateTargetEnum.Nozzle.value < len(apps) - 1:
-                board = convert_app_record(board, apps[updateTargetEnum.Nozzle.value])
-            if board['type']['name'] == 'Cooling' and updateTargetEnum.Cooling.value < len(apps) - 1:
-                board = convert_app_record(board, apps[updateTargetEnum.Cooling.value])
-            if board['type']['name'] == 'QR Reader' and updateTargetEnum.QR.value < len(apps) - 1:
-                board = convert_app_record(board, apps[updateTargetEnum.QR.value])
-            curr_board_url = "https://api.backbar.com/board/" + str(board['id'])
-            response = requests.request("PUT", curr_board_url, headers=headers, json=board)
-            if response.status_code != 200:
-                fail = True
-            print("     HTTP response: " + str(response.status_code) + "\n")
-            append_file(fname, "\n        HTTP response: " + str(response.status_code))
-            append_file(fname, "\n        HTTP text:     " + response.text + "\n\n")
+            failed = [board.type_name + " is " + board.status + " on " + format_app_version(board.application)
+                      for board, version in queued if format_app_version(board.application) != version]
+            outcome[machine_id] = "; ".join(failed) if failed else None
+            changed = True
+        pending = [machine_id for machine_id in pending if machine_id not in outcome]
+        interval = POLL_MIN_SECONDS if changed else min(interval * POLL_BACKOFF, POLL_MAX_SECONDS)
+    for machine_id in pending:
+        outcome[machine_id] = "still Pending after " + str(args.poll_timeout) + "s"
+    return {machine_id: outcome.get(machine_id) for machine_id in expected}
 
-    for machine in machines:
-        f = open(fname, 'a')
-        args.machine_status = machine['id']
-        get_machine_status(args, f)
-        f.close()
-    if fail:
-        print("!!! !!! one or more operations failed, check report !!! !!!\n")
-        append_file(fname, "!!! !!! one or more operations failed, check report !!! !!!\n")
+# canary wave first, then --wave-percent batches, each one has to reach --success-threshold
+# before the next is queued, otherwise the rollout halts (and clears the wave with --auto-revert)
+def staged_rollout(apps, machines, args, report):
+    waves = rollout_waves(machines, args.canary, args.wave_percent)
+    all_results = []
+    queued_machines = []
+    for number, wave in enumerate(waves, start=1):
+        print("\n\033[1m*** Wave " + str(number) + "/" + str(len(waves)) + ": " + str(len(wave)) + " machine(s) ***\033[0m\n")
+        report.write("\n***  Wave " + str(number) + "/" + str(len(waves)) + ": " + ", ".join(machine.name for machine in wave) + "\n\n")
+        results = queue_board_updates(apps, wave, args, report)
+        all_results.extend(results)
+        queued_machines.extend(wave)
+        print("Waiting for wave " + str(number) + " to install...\n")
+        outcome = wait_for_wave(wave, results, args)
+        failures = {machine_id: reason for machine_id, reason in outcome.items() if reason is not None}
+        success_rate = 100 * (len(wave) - len(failures)) / len(wave)
+        report.record("wave", wave=number, machines=[machine.id for machine in wave], success_rate=round(success_rate, 1), failures=failures)
+        wave_lines = ["     " + machine.name + ": " + (failures.get(machine.id) or "installed") for machine in wave]
+        print("\n".join(wave_lines) + "\n\nWave " + str(number) + " success rate " + str(round(success_rate, 1)) + "%\n")
+        report.write("\n".join(wave_lines) + "\n     success rate " + str(round(success_rate, 1)) + "%\n")
+        report.flush()
+        for machine in wave:
+            if machine.id in failures:
+                all_results.append(board_result(machine, None, "Rollout gate", None, failures[machine.id]))
+        if success_rate >= args.success_threshold:
+            continue
+
+        halted = "!!! !!! wave " + str(number) + " is below the " + str(args.success_threshold) + "% success threshold, rollout halted, " + \
+                 str(len(machines) - len(queued_machines)) + " machine(s) not queued !!! !!!\n"
+        print(halted)
+        report.write("\n" + halted)
+        report.record("halted", wave=number, not_queued=[machine.id for machine in machines[len(queued_machines):]])
+        if args.auto_revert:
+            print("Reverting queued updates on wave " + str(number) + "...\n")
+            report.write("\n***  Revert wave " + str(number) + "\n\n")
+            all_results.extend(queue_board_updates({target: "None" for target in apps}, wave, args, report))
+        break
+
+    write_fleet_status(queued_machines, args, report)
+    write_rollout_summary(all_results, report)
+    return all_results
+
+def run_rollout(apps, machines, args, report):
+    if args.canary is not None and any(app != "None" for app in apps.values()):
+        return staged_rollout(apps, machines, args, report)
+    return update_board_records(apps, machines, args, report)
+
+def write_fleet_status(machines, args, report):
+    all_boards = fetch_fleet_boards([machine.id for machine in machines])
+    for machine, boards_full_info in zip(machines, all_boards):
+        report.write("\nRetrieving firmware status for Machine ID " + str(machine.id) + "...\n\n")
+        if isinstance(boards_full_info, Exception) or not boards_full_info:
+            report.write("!!! could not retrieve boards: " + str(boards_full_info) + "\n\n")
+            report.record("board_status", machine=machine.name, machine_id=machine.id, error=str(boards_full_info))
+            continue
+        print_machine_status(boards_full_info, report)
+        for row in board_status_rows(boards_full_info):
+            report.record("board_status", machine=machine.name, machine_id=machine.id, **dict(zip(BOARD_STATUS_HEADER, row)))
+    report.flush()
+
+# one buffered handle for the text report and one for its ndjson twin, kept open for the whole run
+# both are flushed after every machine and closed with a note if the run is interrupted,
+# so a partial report is still complete up to the last machine and every ndjson line parses
+# mode "a" keeps adding to one report across runs (revert.txt holds the history of every --clear)
+class FwUpdateReport:
+    def __init__(self, fname, mode="w"):
+        self.fname = fname
+        self.json_fname = os.path.splitext(fname)[0] + ".ndjson"
+        self.text = open(fname, mode, buffering=REPORT_BUFFER_SIZE)
+        self.events = open(self.json_fname, mode, buffering=REPORT_BUFFER_SIZE)
+
+    def write(self, content):
+        self.text.write(content)
+
+    def record(self, event, **fields):
+        self.events.write(json.dumps({"event": event, **fields}) + "\n")
+
+    def flush(self):
+        self.text.flush()
+        self.events.flush()
+
+    def close(self):
+        self.text.close()
+        self.events.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.write("\n!!! !!! run interrupted (" + exc_type.__name__ + "), report is incomplete !!! !!!\n")
+            self.record("interrupted", error=exc_type.__name__)
+        self.close()
 
 def generate_fw_update_report(selected_machines, all_apps):
     pst = pytz.timezone('America/Los_Angeles')
@@ -527,138 +2294,314 @@ def generate_fw_update_report(selected_machines, all_apps):
     date    = "***\n***  Date: " + now_pst.strftime("%Y-%m-%d %H:%M:%S %Z %z")
     divider = "\n***  ***  ***  ***  ***  ***  ***  ***  ***  ***  ***  ***  ***  ***\n" 
     fname   = "FW-UPDATE-REPORT_" + now_pst.strftime("%Y-%m-%d_%H-%M-%S_%Z%z" + ".txt")
-    write_file(fname, header+date+divider)
-    append_file(fname, "\n-- List of Machines -- -- -- -- -- -- -- \n\n")
-    for machine in selected_machines:
-        append_file(fname, "* " + machine['name'] + "\n")
-    append_file(fname, "\n\n\n-- List of Firmware Apps  -- -- -- -- --  \n\n\n")
+    report  = FwUpdateReport(fname)
+    report.record("report", date=now_pst.isoformat(), machines=[{"id": machine.id, "name": machine.name} for machine in selected_machines])
+    lines = [header + date + divider, "\n-- List of Machines -- -- -- -- -- -- -- \n\n"]
+    lines += ["* " + machine.name + "\n" for machine in selected_machines]
+    lines.append("\n\n\n-- List of Firmware Apps  -- -- -- -- --  \n\n\n")
     app_list = []
-    for app in all_apps:
+    for app in all_apps.values():
         if app != "None":
-            if app['notes'] is not None and app['notes'] != "" and len(app['notes']) > 2:
-                notes = app['notes']
+            if app.notes is not None and app.notes != "" and len(app.notes) > 2:
+                notes = app.notes
             else:
                 notes = "!!!! PROD RELEASE - no notes !!!!"
-            app_list.append([
-                app['type']['name'],
-                str(app['fwMajor']) + "." + str(app['fwMinor']) + "." + str(app['fwPatch']),
-                notes,
-                str(app['filePath'])
-            ])
-    col_widths = [max(len(row[i]) for row in app_list) for i in range(len(app_list[0]))]
-    headers = ["Target", "Version", "Notes", "URL"]
-    header_line = " ".join(headers[i].ljust(col_widths[i] + 3) for i in range(len(headers)))
-    append_file(fname, header_line + "\n")
-    append_file(fname,"-" * len(header_line) + "\n")
-    for row in app_list:
-        for i, item in enumerate(row):
-            append_file(fname, item.ljust(col_widths[i] + 4))
-        append_file(fname, "\n")
-    append_file(fname, "\n\n***  Results   ***  ***  ***  ***  ***  ***  ***  ***  ***  ***  ***\n\n")
-    return fname
+            app_list.append([app.target, app.version_str, notes, str(app.file_path)])
+            report.record("app", target=app.target, app_id=app.id, version=app.version_str, notes=app.notes, url=app.file_path)
+    if app_list:
+        lines.append(render_table([["Target", "Version", "Notes", "URL"]] + app_list))
+    lines.append("\n\n***  Results   ***  ***  ***  ***  ***  ***  ***  ***  ***  ***  ***\n\n")
+    report.write("".join(lines))
+    report.flush()
+    return report
+
+def format_app_version(app):
+    if app is None or app == "None":
+        return "N/A"
+    return app.label
+
+def same_app(app, other):
+    return app is not None and other is not None and app != "None" and other != "None" and \
+           app.version == other.version and (app.notes or "") == (other.notes or "")
+
+# what queuing app on a board would change, "None" means clearing whatever is queued
+def board_plan_change(board, app):
+    if app == "None":
+        return "clear" if board.scheduled is not None else "nothing queued"
+    if same_app(board.scheduled, app):
+        return "already queued"
+    if board.scheduled is None and same_app(board.application, app):
+        return "already installed"
+    return "update"
+
+PLAN_MACHINE_FILTERS = ['org', 'name_filter', 'name_prefix', 'name_regex', 'id_range', 'serial']
+
+def load_plan(path):
+    import yaml
+    try:
+        with open(path) as f:
+            plan = yaml.safe_load(f)
+    except (OSError, yaml.YAMLError) as e:
+        print("Error: could not read plan " + path + ": " + str(e))
+        sys.exit(1)
+    if not isinstance(plan, dict):
+        print("Error: plan " + path + " must be a mapping with 'machines' and 'apps'")
+        sys.exit(1)
+    return plan
+
+def as_list(value):
+    return [str(item) for item in value] if isinstance(value, list) else [str(value)]
+
+# explicit IDs plus every machine matching the plan's filters (filters are combined like the cli flags)
+def resolve_plan_machines(plan, errors):
+    spec = plan.get('machines')
+    if isinstance(spec, list):
+        spec = {'ids': spec}
+    if not isinstance(spec, dict) or not spec:
+        errors.append("plan has no 'machines' (ids and/or " + ", ".join(PLAN_MACHINE_FILTERS) + ")")
+        return []
+    for key in spec:
+        if key != 'ids' and key not in PLAN_MACHINE_FILTERS:
+            errors.append("unknown machine filter '" + str(key) + "' (use ids, " + ", ".join(PLAN_MACHINE_FILTERS) + ")")
+    filter_args = argparse.Namespace(gregorys=False, backbar=False, server_filter=False, **{key: None for key in PLAN_MACHINE_FILTERS})
+    for key in ('org', 'id_range', 'serial'):
+        if spec.get(key) is not None:
+            setattr(filter_args, key, as_list(spec[key]))
+    for key in ('name_filter', 'name_prefix', 'name_regex'):
+        if spec.get(key) is not None:
+            setattr(filter_args, key, str(spec[key]))
+
+    index = get_machine_index()
+    machines = []
+    known_ids = set()
+    for machine_id in spec.get('ids') or []:
+        machine = index.get(machine_id)
+        if machine is None:
+            errors.append("machine ID " + str(machine_id) + " does not exist")
+        elif machine.id not in known_ids:
+            machines.append(machine)
+            known_ids.add(machine.id)
+    if has_machine_filter(filter_args):
+        try:
+            matched = find_machines(filter_args)
+        except re.error as e:
+            errors.append("invalid name_regex: " + str(e))
+            matched = []
+        if not matched:
+            errors.append("machine filters match no machines (" + describe_machine_filter(filter_args) + ")")
+        machines += [machine for machine in matched if machine.id not in known_ids]
+    return machines
+
+# apps: {target: "1.4.2"} or {target: {version: 1.4.2, notes: release-83}}, targets left out or set to none are not
+# updated, "clear" clears whatever is queued on them
+def resolve_plan_apps(plan, catalog, errors):
+    spec = plan.get('apps') or {}
+    default_notes = plan.get('notes')
+    apps = {}
+    if not isinstance(spec, dict):
+        errors.append("plan 'apps' must map targets to versions")
+        return apps
+    for target_name, wanted in spec.items():
+        board_type = BOARD_TYPES_BY_KEY.get(catalog_key(str(target_name)))
+        if board_type is None or not board_type.updatable:
+            errors.append("unknown target '" + str(target_name) + "' (use " + ", ".join(catalog_key(target) for target in UPDATE_TARGETS) + ")")
+            continue
+        target = board_type.name
+        if wanted is None or str(wanted).lower() == "none":
+            continue
+        if str(wanted).lower() == "clear":
+            apps[target] = "None"
+            continue
+        version, notes = (wanted.get('version'), wanted.get('notes', default_notes)) if isinstance(wanted, dict) else (wanted, default_notes)
+        match = re.fullmatch(r"(\d+)\.(\d+)\.(\d+)", str(version).strip())
+        if match is None:
+            errors.append(target + ": version '" + str(version) + "' is not MAJOR.MINOR.PATCH (quote it in yaml)")
+            continue
+        candidates = [app for app in catalog.get(target, notes) if app.version == tuple(int(part) for part in match.groups())]
+        notes_str = " with notes '" + str(notes) + "'" if notes is not None else ""
+        if not candidates:
+            errors.append(target + ": no application " + str(version).strip() + notes_str + " in the catalog")
+        elif len({app.notes or "" for app in candidates}) > 1:
+            errors.append(target + ": " + str(version).strip() + " is ambiguous, add notes (one of: " +
+                          ", ".join(sorted("'" + (app.notes or "PROD") + "'" for app in candidates)) + ")")
+        else:
+            apps[target] = candidates[-1]
+    return apps
+
+def print_plan_diff(machines, apps):
+    all_boards = fetch_fleet_boards([machine.id for machine in machines])
+    rows = []
+    for machine, boards_full_info in zip(machines, all_boards):
+        if isinstance(boards_full_info, Exception):
+            rows.append([machine.name, str(machine.id), "-", "-", "-", "-", "ERROR: " + str(boards_full_info)])
+            continue
+        for board in boards_full_info:
+            app = apps.get(board.type_name)
+            if app is None:
+                continue
+            rows.append([machine.name, str(machine.id), board.label, format_app_version(board.application),
+                         format_app_version(board.scheduled), format_app_version(app), board_plan_change(board, app)])
+    print("\033[1mPlanned changes:\033[0m\n")
+    print(render_table([["Machine", "ID", "Target", "Current FW", "Queued FW", "Planned FW", "Change"]] + rows))
+
+def run_plan(args):
+    print("\nLoading rollout plan " + args.plan + "...\n")
+    plan = load_plan(args.plan)
+    errors = []
+    machines = resolve_plan_machines(plan, errors)
+    apps = no_apps() if args.clear else resolve_plan_apps(plan, get_app_catalog(), errors)
+    if not args.clear and not apps and not errors:
+        errors.append("plan does not select an application or clear for any target (" + ", ".join(UPDATE_TARGETS) + ")")
+    if errors:
+        print("!!! plan " + args.plan + " is invalid:\n")
+        for error in errors:
+            print("  * " + error)
+        print()
+        sys.exit(1)
+
+    print("\033[1mMachines (" + str(len(machines)) + "):\033[0m\n")
+    for machine in machines:
+        print("* " + machine.name + " (ID " + str(machine.id) + ")")
+    if args.clear:
+        print("\n\033[1mClearing queued firmware updates on all of these machines\033[0m\n")
+    else:
+        print("\n\033[1mFirmware Applications: \033[0m\n")
+        print_all_app_details(apps)
+        print()
+    print_plan_diff(machines, apps)
+    if not args.yes:
+        wait_for_specific_input("yes")
+
+    report = FwUpdateReport("revert.txt", "a") if args.clear else generate_fw_update_report(machines, apps)
+    with report:
+        results = run_rollout(apps, machines, args, report)
+    print("*** Report saved to " + report.fname + " and " + report.json_fname + " ***\n")
+    if any(not result['ok'] for result in results):
+        sys.exit(1)
 
 def update_fw(args):
     print("\nStarting firmware update interface...\n")
-    filter_str = "with filter 'Gregorys Coffee'...\n" if args.gregorys else \
-                 "with filter 'BackBar'...\n" if args.backbar else \
-                  "with filter '" + str(args.name_filter) + "'...\n" if args.name_filter else "...\n"
+    filter_str = "with filter " + describe_machine_filter(args) + "...\n" if has_machine_filter(args) else "...\n"
     print("Retrieving list of machines " + filter_str)
-    full_machines_list = get_list_of_all_machines()
-    filtered_machines_list = []
-    for machine in full_machines_list:
-        if args.gregorys:
-            if (machine['location']['organization']['name'] == 'Gregorys Coffee'):
-                filtered_machines_list.append(machine)
-        elif args.backbar:
-            if (machine['location']['organization']['name'] == 'BackBar'):
-                filtered_machines_list.append(machine)
-        elif args.name_filter:
-            if (args.name_filter in machine['name']):
-                filtered_machines_list.append(machine)
-        else:
-            filtered_machines_list.append(machine)
+    filtered_machines_list = find_machines(args)
 
     notes_filter  = args.notes_filter if args.notes_filter else None
     notes_filter_str = ", filtered by notes '" + notes_filter + "'...\n" if notes_filter is not None else "...\n"
     print("Retrieving lists of recent applications, organized per target" + notes_filter_str)
-    main_apps     = get_list_of_apps(target.main.name, notes_filter)
-    solenoid_apps = get_list_of_apps(target.solenoid.name, notes_filter)
-    pump_apps     = get_list_of_apps(target.pump.name, notes_filter)
-    nozzle_apps   = get_list_of_apps(target.nozzle.name, notes_filter)
-    cooling_apps  = get_list_of_apps(target.cooling.name, notes_filter)
-    qr_apps       = get_list_of_apps("QR Reader", notes_filter)
+    catalog = get_app_catalog()
 
     selected_machines     = present_list_of_machines(filtered_machines_list)
     if args.clear:
         print("\nClearing queued firmware updates for all selected machines...\n")
-        all_apps = ["None", "None", "None", "None", "None", "None", "None", "None"]
-        update_board_records(all_apps, selected_machines, args, "revert.txt")
+        all_apps = no_apps()
+        with FwUpdateReport("revert.txt", "a") as report:
+            update_board_records(all_apps, selected_machines, args, report)
         exit()
-    selected_main_app     = present_list_of_apps(main_apps[-13:])
-    selected_solenoid_app = present_list_of_apps(solenoid_apps[-13:])
-    selected_pump_app     = present_list_of_apps(pump_apps[-13:])
-    selected_nozzle_app   = present_list_of_apps(nozzle_apps[-13:])
-    selected_cooling_app  = present_list_of_apps(cooling_apps[-13:])
-    selected_qr_app       = present_list_of_apps(qr_apps[-13:])
-
-    all_apps = [selected_main_app, selected_solenoid_app, 
-                selected_pump_app, selected_nozzle_app, 
-                selected_cooling_app, selected_qr_app]
+    all_apps = {target: present_list_of_apps(catalog, target, notes_filter) for target in UPDATE_TARGETS}
 
     clear_screen()
     for i in range(5):
         print_at_top("\033[1m*** SUMMARY OF ALL SELECTION OPTIONS ***\033[0m\n")
-        time.sleep(0.3)
+        ui_pause(0.3)
         print_at_top("")
-        time.sleep(0.2)
+        ui_pause(0.2)
     print_at_top("\033[1m*** SUMMARY OF ALL SELECTION OPTIONS ***\033[0m\n")
     print()
-    time.sleep(0.5)
+    ui_pause(0.5)
     print("\n\033[1mMachines:\033[0m\n")
     for machine in selected_machines:
-        print("* " + machine['name'])
+        print("* " + machine.name)
     print("\n\n\033[1mFirmware Applications: \033[0m\n")
     print_all_app_details(all_apps)
-    time.sleep(2)
+    ui_pause(2)
     for i in range(7):
         print_at_bottom("\033[1m!!!!!! REVIEW SELECTED OPTIONS CAREFULLY !!!!!!!\033[0m")
-        time.sleep(0.4)
+        ui_pause(0.4)
         print_at_bottom("")
-        time.sleep(0.3)
+        ui_pause(0.3)
     print_at_bottom("\033[1m!!!!!! REVIEW SELECTED OPTIONS CAREFULLY !!!!!!!\033[0m")
-    time.sleep(1)
+    ui_pause(1)
     print("\n")
     wait_for_specific_input("yes")
     clear_screen()
     print("\nGenerating report...\n")
-    fname = generate_fw_update_report(selected_machines, all_apps)
-
-    update_board_records(all_apps, selected_machines, args, fname)
+    with generate_fw_update_report(selected_machines, all_apps) as report:
+        run_rollout(all_apps, selected_machines, args, report)
+    print("*** Report saved to " + report.fname + " and " + report.json_fname + " ***\n")
     print("\n\033[1mDone queuing updates for all boards for selected machines :)\033[0m\n")
 
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  
 
 def main():
-    global apikey, authtoken
+    global api, engine
     args = setup_argpase()
     apikey, authtoken = read_key_and_token(args)
+    response_cache = ResponseCache(CACHE_DIR, CACHE_MAX_BYTES, enabled=not args.no_cache, refresh=args.refresh)
+    limits = {
+        "read"  : AdaptiveLimiter("read", args.read_rate, args.max_workers),
+        "write" : AdaptiveLimiter("write", args.write_rate, args.max_workers)
+    }
+    api = ApiClient(apikey, authtoken, base_url=args.base_url.rstrip("/"), pool_size=args.max_workers, timeout=(CONNECT_TIMEOUT, args.timeout), cache=response_cache, limits=limits)
+    engine = FanOutEngine(args.max_workers, args.host_rate)
 
+    profiler.enabled = args.profile or args.profile_trace is not None
+    try:
+        run_commands(args)
+    finally:
+        if profiler.enabled:
+            print(profiler.summary(), file=sys.stderr)
+        if args.profile_trace:
+            profiler.write_trace(args.profile_trace)
+            print("*** Trace saved to " + args.profile_trace + " ***\n", file=sys.stderr)
+
+def run_commands(args):
     if args.list_all_machines:
-        list_all_machines(args)
+        with profiler.phase("--list-all-machines"):
+            list_all_machines(args)
     if args.list_latest_apps:
-        list_latest_apps(args)
+        with profiler.phase("--list-latest-apps"):
+            list_latest_apps(args)
     if args.list_logs:
-        list_logs(args)
-    if args.machine_status:
-        get_machine_status(args, None)
-    if args.graph_temps:
-        graph_temps(args)
-    if args.update_fw:
-        update_fw(args)
+        with profiler.phase("--list-logs"):
+            list_logs(args)
+    if args.sync_logs is not None:
+        with profiler.phase("--sync-logs"):
+            sync_logs(args)
+    if args.machine_status is not None:
+        with profiler.phase("--machine-status"):
+            get_machine_status(args, None)
+    if args.snapshot is not None:
+        with profiler.phase("--snapshot"):
+            snapshot(args)
+    if args.query_fw:
+        with profiler.phase("--query-fw"):
+            query_fw(args)
+    if args.graph_temps is not None:
+        with profiler.phase("--graph-temps"):
+            graph_temps(args)
+    if args.render_temps:
+        with profiler.phase("--render-temps"):
+            render_temps(args)
+    if args.analyze_temps:
+        with profiler.phase("--analyze-temps"):
+            analyze_temps(args)
+    if args.fleet_temps is not None:
+        with profiler.phase("--fleet-temps"):
+            fleet_temps(args)
+    if args.plan:
+        with profiler.phase("--plan"):
+            run_plan(args)
+    elif args.update_fw:
+        with profiler.phase("--update-fw"):
+            update_fw(args)
 
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  
 #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  #  
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\nCancelled, requests still queued were dropped\n")
+        sys.exit(130)
\ No newline at end of file